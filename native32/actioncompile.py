@@ -0,0 +1,307 @@
+import sys
+import io
+import ast
+import contextlib
+
+from actions import Action
+from tracing import TRACE, DEBUG
+from actionvm import ActionVM, ActionProp, Variables, ops, _text, _value, _UNSET
+
+__all__ = ["compile_action"]
+
+# Turns an action entry point into a Python function with the same behaviour as ActionVM.interpret. Code is
+# split into basic blocks at jump targets the same way decompile() finds them. Inside a block the stack is
+# tracked symbolically (pushed values live in locals), and only what is left over at the end of the block is
+# spilled to the real stack. Scripts using anything not handled here return None and stay interpreted.
+
+_SIMPLE_CALLS = {
+    Action.Stop: "emu.stop(target)",
+    Action.Play: "emu.play(target)",
+    Action.StopSounds: "emu.stop_sounds(target)",
+    Action.NextFrame: "emu.goto_frame(target, emu.get_frame(target) + 1)",
+    Action.PreviousFrame: "emu.goto_frame(target, emu.get_frame(target) - 1)",
+}
+
+class _Unsupported(Exception):
+    pass
+
+def _jump_dst(i, payload):
+    return i + payload + 1 if payload >= 0 else i + payload
+
+def _explore(reader, index):
+    code = {}
+    to_explore = [index]
+    leaders = {index}
+    while len(to_explore) > 0:
+        i = to_explore.pop()
+        while i not in code:
+            action = reader.get_action(i)
+            if action is None:
+                raise _Unsupported(f"runs off the action table at {i}")
+            op, payload = action
+            code[i] = action
+            if op == Action.End:
+                break
+            elif op in (Action.If, Action.Jump):
+                if payload is None:
+                    raise _Unsupported(f"{op.name} without a target at {i}")
+                dst = _jump_dst(i, payload)
+                leaders.add(dst)
+                to_explore.append(dst)
+                if op == Action.Jump:
+                    break
+                leaders.add(i + 1)
+            i += 1
+    return code, leaders
+
+class _Block:
+    def __init__(self):
+        self.lines = []
+        self.stack = [] # expressions for values pushed in this block, the real stack is underneath
+        self.temps = 0
+
+    def emit(self, line):
+        self.lines.append(line)
+
+    def pop(self):
+        if len(self.stack) > 0:
+            return self.stack.pop()
+        t = self.temp()
+        self.emit(f"{t} = pop()")
+        return t
+
+    def temp(self):
+        self.temps += 1
+        return f"t{self.temps}"
+
+    def push_result(self, expr):
+        t = self.temp()
+        self.emit(f"{t} = {expr}")
+        self.stack.append(t)
+
+    def spill(self):
+        for x in self.stack:
+            self.emit(f"push({x})")
+        self.stack = []
+
+def _const_name(expr):
+    # the name if expr is a constant string pushed in this block
+    if expr[0] in "'\"":
+        return ast.literal_eval(expr)
+    return None
+
+def _compile_block(code, leaders, start, program, used_slots):
+    b = _Block()
+    i = start
+    while True:
+        op, payload = code[i]
+        if op == Action.Push:
+            b.stack.append(repr(payload))
+        elif op == Action.SetVariable:
+            val = b.pop()
+            var = b.pop()
+            b.emit("if TRACE.vm:")
+            b.emit(f'    TRACE.emit("vm", DEBUG, "  {{}} = {{}}".format(_text({var}), _text({val})), var=_text({var}), value=_text({val}))')
+            name = _const_name(var)
+            if name is not None:
+                slot = program.slot(name)
+                used_slots.add(slot)
+                b.emit(f"values[{slot}] = {val}")
+            else:
+                b.emit(f"vars.set(_text({var}), {val})")
+        elif op == Action.GetVariable:
+            var = b.pop()
+            name = _const_name(var)
+            if name is not None:
+                slot = program.slot(name)
+                used_slots.add(slot)
+                t = b.temp()
+                b.emit(f"{t} = values[{slot}]")
+                b.emit(f'if {t} is _UNSET: {t} = ""')
+                b.stack.append(t)
+            else:
+                b.push_result(f"vars.get(_text({var}))")
+        elif op in ops:
+            arg_count, func = ops[op]
+            args = [b.pop() for j in range(arg_count)]
+            b.push_result(f"op_{int(op):02x}({', '.join(reversed(args))})")
+        elif op == Action.Jump:
+            b.spill()
+            b.emit(f"block = {_jump_dst(i, payload)}")
+            return b.lines
+        elif op == Action.If:
+            cond = b.pop()
+            b.spill()
+            b.emit(f"if int(float({cond})):")
+            b.emit(f"    block = {_jump_dst(i, payload)}")
+            b.emit("else:")
+            b.emit(f"    block = {i + 1}")
+            return b.lines
+        elif op == Action.Pop:
+            if len(b.stack) > 0:
+                b.stack.pop()
+            else:
+                b.emit("pop()")
+        elif op in _SIMPLE_CALLS:
+            b.emit(_SIMPLE_CALLS[op])
+        elif op == Action.GotoFrame:
+            if payload is None:
+                raise _Unsupported(f"GotoFrame without a frame at {i}")
+            b.emit(f"emu.goto_frame(target, {int(payload) + 1})")
+        elif op == Action.SetTarget:
+            b.emit(f"target = {payload!r}")
+        elif op == Action.GotoFrame2:
+            if payload is None:
+                raise _Unsupported(f"GotoFrame2 without flags at {i}")
+            b.emit(f"emu.goto_frame(target, int(float({b.pop()})), {payload & 0x1})")
+        elif op == Action.SetTarget2:
+            b.emit(f"target = _text({b.pop()})")
+        elif op == Action.SetProperty:
+            o3 = b.pop()
+            o2 = b.pop()
+            o1 = b.pop()
+            prop = b.temp()
+            b.emit(f"{prop} = ActionProp(int(_text({o2})))")
+            b.emit("if TRACE.vm:")
+            b.emit(f'    TRACE.emit("vm", DEBUG, "   SetProperty({{}}, {{}}, {{}})".format(_text({o1}), {prop}.name, _text({o3})))')
+            b.emit(f"emu.set_property(_text({o1}), {prop}, _text({o3}))")
+        elif op == Action.GetProperty:
+            o2 = b.pop()
+            o1 = b.pop()
+            prop = b.temp()
+            t = b.temp()
+            b.emit(f"{prop} = ActionProp(int(_text({o2})))")
+            b.emit(f"{t} = _value(emu.get_property(_text({o1}), {prop}))")
+            b.emit("if TRACE.vm:")
+            b.emit(f'    TRACE.emit("vm", DEBUG, "   GetProperty({{}}, {{}}) -> {{}}".format(_text({o1}), {prop}.name, _text({t})))')
+            b.stack.append(t)
+        elif op == Action.CloneSprite:
+            o3 = b.pop()
+            o2 = b.pop()
+            o1 = b.pop()
+            b.emit(f"emu.clone_sprite(_text({o1}), _text({o2}), int(_text({o3})))")
+        elif op == Action.RemoveSprite:
+            b.emit(f"emu.remove_sprite(_text({b.pop()}))")
+        elif op == Action.Call:
+            b.emit(f"emu.call(int(_text({b.pop()})))")
+        elif op == Action.End:
+            b.emit("return")
+            return b.lines
+        elif op == Action.RandomNumber:
+            b.push_result(f"vm.rand.randrange(int(_text({b.pop()})))")
+        elif op == Action.GetTime:
+            b.push_result("_value(emu.get_time())")
+        elif op == Action.GetUrl2:
+            o2 = b.pop()
+            o1 = b.pop()
+            b.emit(f"emu.get_url(_text({o1}), _text({o2}))")
+        elif op == Action.Trace:
+            b.emit(f'print("Trace: {{}}".format(_text({b.pop()})))')
+        else:
+            raise _Unsupported(f"{op.name} at {i}")
+        i += 1
+        if i in leaders:
+            b.spill()
+            b.emit(f"block = {i}")
+            return b.lines
+
+def compile_action(reader, index):
+    # Returns a function f(vm, target) or None if the script has to be interpreted
+    try:
+        code, leaders = _explore(reader, index)
+        program = reader.get_program()
+        used_slots = set()
+        blocks = {start: _compile_block(code, leaders, start, program, used_slots) for start in sorted(leaders)}
+    except _Unsupported:
+        return None
+
+    src = ["def action(vm, target):",
+           "    emu = vm.emu",
+           "    vars = vm.vars",
+           f"    vars.reserve({max(used_slots, default=-1) + 1})",
+           "    values = vars.values",
+           "    stack = []",
+           "    push = stack.append",
+           "    pop = stack.pop",
+           f"    block = {index}",
+           "    while True:"]
+    for n, (start, lines) in enumerate(blocks.items()):
+        src.append(f"        {'if' if n == 0 else 'elif'} block == {start}:")
+        src.extend(f"            {line}" for line in lines)
+    src = "\n".join(src) + "\n"
+
+    namespace = {"_text": _text, "_value": _value, "_UNSET": _UNSET, "ActionProp": ActionProp, "TRACE": TRACE, "DEBUG": DEBUG}
+    for op, (arg_count, func) in ops.items():
+        namespace[f"op_{int(op):02x}"] = func
+    exec(compile(src, f"<action {index}>", "exec"), namespace)
+    func = namespace["action"]
+    func.source = src
+    return func
+
+class _RecordingEmu:
+    # Stands in for N32Emu when checking the compiler, logging every call a script makes
+    def __init__(self, reader):
+        self.r = reader
+        self.log = []
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.log.append((name, args))
+            if name in ("get_frame", "get_property", "get_time"):
+                return 1
+        return call
+
+def _run_logged(index, compiled, reader, vars):
+    emu = _RecordingEmu(reader)
+    vm = ActionVM(emu, compile_scripts=compiled)
+    vm.vars = vars
+    out = io.StringIO()
+    TRACE.ring.clear()
+    try:
+        with contextlib.redirect_stdout(out):
+            vm.run(index, "")
+        error = None
+    except Exception as e:
+        error = repr(e)
+    trace = [record["msg"] for record in TRACE.ring]
+    return emu.log, out.getvalue(), trace, {name: _text(value) for name, value in vars.items()}, error
+
+def check_file(path):
+    # Differential check: every entry point must behave identically compiled and interpreted
+    from process_file import Native32Reader, ObjectType
+    with open(path, "rb") as f:
+        r = Native32Reader(f, use_mmap=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        r.init()
+    r.load_tables()
+    entries = set()
+    for frame in r._frames_cache.values():
+        for obj in frame:
+            if obj.obj_type == ObjectType.Action:
+                entries.add(obj.index)
+            elif obj.obj_type == ObjectType.Button:
+                entries.update(event for keycode, event in r.get_button_events(obj.index))
+    for movie in r._movies_cache.values():
+        entries.update(fr.action for fr in movie if fr.action != 0)
+
+    TRACE.enable(["vm"])
+    compiled = failed = 0
+    interp_vars = Variables(r.get_program())
+    compiled_vars = Variables(r.get_program())
+    for index in sorted(entries):
+        if compile_action(r, index) is not None:
+            compiled += 1
+        # run the scripts in sequence, so later ones see the variables set by earlier ones
+        expected = _run_logged(index, False, r, interp_vars)
+        result = _run_logged(index, True, r, compiled_vars)
+        if result != expected:
+            failed += 1
+            print(f"  action {index}: compiled and interpreted results differ")
+            print(f"    interpreted: {expected}")
+            print(f"    compiled:    {result}")
+    print(f"{path}: {len(entries)} entry points, {compiled} compiled, {failed} mismatches")
+    return failed == 0
+
+if __name__ == '__main__':
+    ok = all([check_file(path) for path in sys.argv[1:]])
+    sys.exit(0 if ok else 1)
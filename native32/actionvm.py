@@ -1,6 +1,8 @@
 from actions import Action
+from array import array
 from enum import IntEnum
 from random import Random
+from tracing import TRACE, DEBUG
 
 class ActionProp(IntEnum):
     x = 0
@@ -15,6 +17,9 @@ class ActionProp(IntEnum):
     height = 9
     name = 13
 
+# Stack values and variables are kept typed: strings as str, numeric results as int/float. _text() gives the
+# string the value used to be stored as, and is only applied where a string is actually needed.
+
 def _str(x):
     if isinstance(x, float):
         if x == int(x):
@@ -22,7 +27,18 @@ def _str(x):
         return str(x)
     return str(x)
 
+def _text(x):
+    t = type(x)
+    if t is float or t is int:
+        return _str(x)
+    return x
+
 def _float(x):
+    t = type(x)
+    if t is float:
+        return x
+    if t is int:
+        return float(x)
     if x == "":
         return 0
     try:
@@ -33,109 +49,327 @@ def _float(x):
 def _int(x):
     return int(_float(x))
 
+def _number(x):
+    if x - x != 0:
+        _str(x) # inf/nan never made it through a string, raise the same error as that did
+    return x
+
+def _value(x):
+    # values coming back from the emulator
+    t = type(x)
+    if t is int or t is float:
+        return _number(x)
+    return _str(x)
+
 ops = {
     Action.Not: (1, lambda a: int(not _int(a))),
-    Action.Add: (2, lambda a, b: _float(a) + _float(b)),
-    Action.Subtract: (2, lambda a, b: _float(a) - _float(b)),
-    Action.Multiply: (2, lambda a, b: _float(a) * _float(b)),
-    Action.Divide: (2, lambda a, b: _float(a) / _float(b) if _float(b) != 0 else 0),
+    Action.Add: (2, lambda a, b: _number(_float(a) + _float(b))),
+    Action.Subtract: (2, lambda a, b: _number(_float(a) - _float(b))),
+    Action.Multiply: (2, lambda a, b: _number(_float(a) * _float(b))),
+    Action.Divide: (2, lambda a, b: _number(_float(a) / _float(b)) if _float(b) != 0 else 0),
     Action.Equals: (2, lambda a, b: int(_float(a) == _float(b))),
     Action.Less: (2, lambda a, b: int(_float(a) < _float(b))),
     Action.And: (2, lambda a, b: int(_int(a) and _int(b))),
     Action.Or: (2, lambda a, b: int(_int(a) or _int(b))),
-    Action.StringEquals: (2, lambda a, b: _int(a == b)),
-    Action.StringAdd: (2, lambda a, b: a + b),
-    Action.StringLess: (2, lambda a, b: a < b),
-    Action.StringExtract: (3, lambda a, b, c: a[int(b)-1:int(b)-1+int(c)]),
+    Action.StringEquals: (2, lambda a, b: int(_text(a) == _text(b))),
+    Action.StringAdd: (2, lambda a, b: _text(a) + _text(b)),
+    Action.StringLess: (2, lambda a, b: str(_text(a) < _text(b))),
+    Action.StringExtract: (3, lambda a, b, c: _text(a)[int(_text(b))-1:int(_text(b))-1+int(_text(c))]),
     Action.ToInteger: (1, lambda a: _int(a)),
-    Action.CharToAscii: (1, lambda a: ord(a)),
+    Action.CharToAscii: (1, lambda a: ord(_text(a))),
     Action.AsciiToChar: (1, lambda a: chr(_int(a))),
-    Action.StringLength: (1, lambda a: len(a)),
+    Action.StringLength: (1, lambda a: len(_text(a))),
 }
 
 class ActionVM:
-    def __init__(self, emu):
+    def __init__(self, emu, compile_scripts=True):
         self.emu = emu
-        self.vars = {}
+        self.vars = Variables(emu.r.get_program())
         self.rand = Random(0)
+        self.compile_scripts = compile_scripts
+        self._compiled = {} # entry index -> compiled script, or None to interpret
     def run(self, index, target=""):
+        if self.compile_scripts:
+            func = self._compiled.get(index, False)
+            if func is False:
+                from actioncompile import compile_action
+                func = self._compiled[index] = compile_action(self.emu.r, index)
+            if func is not None:
+                return func(self, target)
+        return self.interpret(index, target)
+    def set_var(self, name, value):
+        self.vars.set(name, value)
+    def get_var(self, name):
+        return self.vars.get(name)
+    def interpret(self, index, target=""):
+        program = self.emu.r.get_program()
+        ops = program.ops
+        frame = _Frame(program, target)
         pc = index
-        stack = []
-        while True:
-            npc = pc + 1
-            op, payload = self.emu.r.get_action(pc)
-            if op == Action.Push:
-                stack.append(payload)
-            elif op == Action.SetVariable:
-                val = stack.pop()
-                var = stack.pop()
-                print(f"  {var} = {val}")
-                self.vars[var.lower()] = val
-            elif op == Action.GetVariable:
-                stack.append(self.vars.get(stack.pop().lower(), ""))
-            elif op in ops:
-                arg_count, func = ops[op]
-                args = [stack.pop() for i in range(arg_count)]
-                stack.append(_str(func(*reversed(args))))
-            elif op == Action.Jump:
-                npc = pc+payload+1 if payload >= 0 else pc+payload
-            elif op == Action.If:
-                cond = int(float(stack.pop()))
-                if cond:
-                    npc = pc+payload+1 if payload >= 0 else pc+payload
-            elif op == Action.Pop:
-                stack.pop()
-            elif op == Action.Stop:
-                self.emu.stop(target)
-            elif op == Action.Play:
-                self.emu.play(target)
-            elif op == Action.StopSounds:
-                self.emu.stop_sounds(target)
-            elif op == Action.NextFrame:
-                self.emu.goto_frame(target, self.emu.get_frame(target) + 1)
-            elif op == Action.PreviousFrame:
-                self.emu.goto_frame(target, self.emu.get_frame(target) - 1)
-            elif op == Action.GotoFrame:
-                self.emu.goto_frame(target, int(payload) + 1)
-            elif op == Action.SetTarget:
-                target = payload
-            elif op == Action.GotoFrame2:
-                self.emu.goto_frame(target, int(float(stack.pop())), payload & 0x1)
-            elif op == Action.SetTarget2:
-                target = stack.pop()
-            elif op == Action.SetProperty:
-                o3 = stack.pop()
-                o2 = stack.pop()
-                o1 = stack.pop()
-                print(f"   SetProperty({o1}, {ActionProp(int(o2)).name}, {o3})")
-                self.emu.set_property(o1, ActionProp(int(o2)), o3)
-            elif op == Action.GetProperty:
-                o2 = stack.pop()
-                o1 = stack.pop()
-                result = _str(self.emu.get_property(o1, ActionProp(int(o2))))
-                print(f"   GetProperty({o1}, {ActionProp(int(o2)).name}) -> {result}")
-                stack.append(result)
-            elif op == Action.CloneSprite:
-                o3 = stack.pop()
-                o2 = stack.pop()
-                o1 = stack.pop()
-                self.emu.clone_sprite(o1, o2, int(o3))
-            elif op == Action.RemoveSprite:
-                self.emu.remove_sprite(stack.pop())
-            elif op == Action.Call:
-                self.emu.call(int(stack.pop()))
-            elif op == Action.End:
-                break
-            elif op == Action.RandomNumber:
-                stack.append(_str(self.rand.randrange(int(stack.pop()))))
-            elif op == Action.GetTime:
-                stack.append(_str(self.emu.get_time()))
-            elif op == Action.GetUrl2:
-                o2 = stack.pop()
-                o1 = stack.pop()
-                self.emu.get_url(o1, o2)
-            elif op == Action.Trace:
-                print(f"Trace: {stack.pop()}")
-            else:
-                assert False, (pc, op, payload)
-            pc = npc
+        # a jump out of the table ends the script like End does
+        while 0 < pc < len(ops):
+            pc = _HANDLERS[ops[pc]](self, frame, pc)
+
+INVALID_OP = 0xFF # not an Action, marks entries past the end of the table
+PUSH_GET_VARIABLE = 0xFE # Push of a constant name followed by GetVariable, operand is the variable slot
+
+class Program:
+    # The action table predecoded into parallel arrays indexed by (1-based) action index: opcodes, operands
+    # (absolute jump targets for If/Jump, variable slots) and the payloads
+    def __init__(self, actions):
+        self.actions = actions
+        self.ops = array('B', [INVALID_OP]) * len(actions)
+        self.operands = array('l', [0]) * len(actions)
+        self.payloads = [None] * len(actions)
+        # variable name (any spelling) -> slot, slot_names is the canonical (lower case) name of each slot
+        self.slots = {}
+        self.slot_names = []
+        for pc, action in enumerate(actions):
+            if action is None:
+                continue
+            op, payload = action
+            self.payloads[pc] = payload
+            if op in (Action.If, Action.Jump):
+                if not isinstance(payload, int):
+                    continue # no target, left invalid so it fails when reached
+                self.operands[pc] = pc+payload+1 if payload >= 0 else pc+payload
+            self.ops[pc] = op
+        for pc in range(1, len(actions) - 1):
+            if self.ops[pc] == Action.Push and self.ops[pc + 1] == Action.GetVariable and isinstance(self.payloads[pc], str):
+                self.ops[pc] = PUSH_GET_VARIABLE
+                self.operands[pc] = self.slot(self.payloads[pc])
+
+    def slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            canonical = name.lower()
+            slot = self.slots.get(canonical)
+            if slot is None:
+                slot = len(self.slot_names)
+                self.slot_names.append(canonical)
+                self.slots[canonical] = slot
+            self.slots[name] = slot
+        return slot
+
+_UNSET = object()
+
+class Variables:
+    # Values by slot, slots come from the program so constant names are resolved once per file. Names computed
+    # at run time go through the same case-insensitive name -> slot map.
+    def __init__(self, program):
+        self.program = program
+        self.values = [_UNSET] * len(program.slot_names)
+
+    def reserve(self, count):
+        if len(self.values) < count:
+            self.values.extend([_UNSET] * (count - len(self.values)))
+
+    def get(self, name):
+        slot = self.program.slots.get(name)
+        if slot is None:
+            slot = self.program.slots.get(name.lower())
+            if slot is None:
+                return ""
+        if slot >= len(self.values):
+            return ""
+        value = self.values[slot]
+        return "" if value is _UNSET else value
+
+    def set(self, name, value):
+        slot = self.program.slot(name)
+        if slot >= len(self.values):
+            self.reserve(slot + 1)
+        self.values[slot] = value
+
+    def items(self):
+        return [(self.program.slot_names[slot], value) for slot, value in enumerate(self.values) if value is not _UNSET]
+
+class _Frame:
+    __slots__ = ("stack", "target", "payloads", "operands")
+
+    def __init__(self, program, target):
+        self.stack = []
+        self.target = target
+        self.payloads = program.payloads
+        self.operands = program.operands
+
+# Handlers take (vm, frame, pc) and return the next pc, 0 to stop
+
+def _push(vm, f, pc):
+    f.stack.append(f.payloads[pc])
+    return pc + 1
+
+def _set_variable(vm, f, pc):
+    val = f.stack.pop()
+    var = f.stack.pop()
+    if TRACE.vm:
+        TRACE.emit("vm", DEBUG, f"  {_text(var)} = {_text(val)}", var=_text(var), value=_text(val))
+    vm.vars.set(_text(var), val)
+    return pc + 1
+
+def _get_variable(vm, f, pc):
+    f.stack.append(vm.vars.get(_text(f.stack.pop())))
+    return pc + 1
+
+def _push_get_variable(vm, f, pc):
+    value = vm.vars.values[f.operands[pc]]
+    f.stack.append("" if value is _UNSET else value)
+    return pc + 2
+
+def _op_handler(arg_count, func):
+    if arg_count == 1:
+        def handler(vm, f, pc):
+            f.stack.append(func(f.stack.pop()))
+            return pc + 1
+    elif arg_count == 2:
+        def handler(vm, f, pc):
+            b = f.stack.pop()
+            a = f.stack.pop()
+            f.stack.append(func(a, b))
+            return pc + 1
+    else:
+        def handler(vm, f, pc):
+            args = [f.stack.pop() for i in range(arg_count)]
+            f.stack.append(func(*reversed(args)))
+            return pc + 1
+    return handler
+
+def _jump(vm, f, pc):
+    return f.operands[pc]
+
+def _if(vm, f, pc):
+    cond = int(float(f.stack.pop()))
+    return f.operands[pc] if cond else pc + 1
+
+def _pop(vm, f, pc):
+    f.stack.pop()
+    return pc + 1
+
+def _stop(vm, f, pc):
+    vm.emu.stop(f.target)
+    return pc + 1
+
+def _play(vm, f, pc):
+    vm.emu.play(f.target)
+    return pc + 1
+
+def _stop_sounds(vm, f, pc):
+    vm.emu.stop_sounds(f.target)
+    return pc + 1
+
+def _next_frame(vm, f, pc):
+    vm.emu.goto_frame(f.target, vm.emu.get_frame(f.target) + 1)
+    return pc + 1
+
+def _previous_frame(vm, f, pc):
+    vm.emu.goto_frame(f.target, vm.emu.get_frame(f.target) - 1)
+    return pc + 1
+
+def _goto_frame(vm, f, pc):
+    vm.emu.goto_frame(f.target, int(f.payloads[pc]) + 1)
+    return pc + 1
+
+def _set_target(vm, f, pc):
+    f.target = f.payloads[pc]
+    return pc + 1
+
+def _goto_frame2(vm, f, pc):
+    vm.emu.goto_frame(f.target, int(float(f.stack.pop())), f.payloads[pc] & 0x1)
+    return pc + 1
+
+def _set_target2(vm, f, pc):
+    f.target = _text(f.stack.pop())
+    return pc + 1
+
+def _set_property(vm, f, pc):
+    o3 = f.stack.pop()
+    o2 = f.stack.pop()
+    o1 = f.stack.pop()
+    prop = ActionProp(int(_text(o2)))
+    if TRACE.vm:
+        TRACE.emit("vm", DEBUG, f"   SetProperty({_text(o1)}, {prop.name}, {_text(o3)})")
+    vm.emu.set_property(_text(o1), prop, _text(o3))
+    return pc + 1
+
+def _get_property(vm, f, pc):
+    o2 = f.stack.pop()
+    o1 = f.stack.pop()
+    prop = ActionProp(int(_text(o2)))
+    result = _value(vm.emu.get_property(_text(o1), prop))
+    if TRACE.vm:
+        TRACE.emit("vm", DEBUG, f"   GetProperty({_text(o1)}, {prop.name}) -> {_text(result)}")
+    f.stack.append(result)
+    return pc + 1
+
+def _clone_sprite(vm, f, pc):
+    o3 = f.stack.pop()
+    o2 = f.stack.pop()
+    o1 = f.stack.pop()
+    vm.emu.clone_sprite(_text(o1), _text(o2), int(_text(o3)))
+    return pc + 1
+
+def _remove_sprite(vm, f, pc):
+    vm.emu.remove_sprite(_text(f.stack.pop()))
+    return pc + 1
+
+def _call(vm, f, pc):
+    vm.emu.call(int(_text(f.stack.pop())))
+    return pc + 1
+
+def _end(vm, f, pc):
+    return 0
+
+def _random_number(vm, f, pc):
+    f.stack.append(vm.rand.randrange(int(_text(f.stack.pop()))))
+    return pc + 1
+
+def _get_time(vm, f, pc):
+    f.stack.append(_value(vm.emu.get_time()))
+    return pc + 1
+
+def _get_url2(vm, f, pc):
+    o2 = f.stack.pop()
+    o1 = f.stack.pop()
+    vm.emu.get_url(_text(o1), _text(o2))
+    return pc + 1
+
+def _trace(vm, f, pc):
+    print(f"Trace: {_text(f.stack.pop())}")
+    return pc + 1
+
+def _unsupported(vm, f, pc):
+    op, payload = vm.emu.r.get_program().actions[pc] or (None, None)
+    assert False, (pc, op, payload)
+
+_HANDLERS = [_unsupported] * 256
+for _op, (_argc, _func) in ops.items():
+    _HANDLERS[_op] = _op_handler(_argc, _func)
+for _op, _handler in {
+        Action.Push: _push,
+        Action.SetVariable: _set_variable,
+        Action.GetVariable: _get_variable,
+        Action.Jump: _jump,
+        Action.If: _if,
+        Action.Pop: _pop,
+        Action.Stop: _stop,
+        Action.Play: _play,
+        Action.StopSounds: _stop_sounds,
+        Action.NextFrame: _next_frame,
+        Action.PreviousFrame: _previous_frame,
+        Action.GotoFrame: _goto_frame,
+        Action.SetTarget: _set_target,
+        Action.GotoFrame2: _goto_frame2,
+        Action.SetTarget2: _set_target2,
+        Action.SetProperty: _set_property,
+        Action.GetProperty: _get_property,
+        Action.CloneSprite: _clone_sprite,
+        Action.RemoveSprite: _remove_sprite,
+        Action.Call: _call,
+        Action.End: _end,
+        Action.RandomNumber: _random_number,
+        Action.GetTime: _get_time,
+        Action.GetUrl2: _get_url2,
+        Action.Trace: _trace,
+        PUSH_GET_VARIABLE: _push_get_variable,
+    }.items():
+    _HANDLERS[_op] = _handler
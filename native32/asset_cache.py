@@ -0,0 +1,138 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+__all__ = ["MISSING", "LRUCache", "AssetDedup", "image_nbytes", "sound_nbytes", "table_nbytes"]
+
+MISSING = object()
+
+def image_nbytes(img):
+    if img is None:
+        return 0
+    width, height = img.get_size()
+    return width * height * img.get_bytesize()
+
+def sound_nbytes(sound):
+    if sound is None:
+        return 0
+    fmt, data = sound
+    return len(data)
+
+def table_nbytes(entries):
+    # rough per-record footprint of the parsed frame/movie/button tables
+    if entries is None:
+        return 0
+    return 64 * len(entries)
+
+class LRUCache:
+    def __init__(self, budget=None, sizeof=table_nbytes):
+        self.budget = budget # in bytes, None for unbounded
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # the prefetcher fills caches from a worker thread
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, MISSING)
+            if old is not MISSING:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            if self.budget is not None:
+                # never evict the entry that was just added, even if it doesn't fit on its own
+                while self.nbytes > self.budget and len(self._entries) > 1:
+                    evicted_key, (evicted, evicted_size) = self._entries.popitem(last=False)
+                    self.nbytes -= evicted_size
+                    self.evictions += 1
+
+    def __getitem__(self, key):
+        return self._entries[key][0]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def values(self):
+        with self._lock:
+            return [v for v, size in self._entries.values()]
+
+    def items(self):
+        with self._lock:
+            return [(k, v) for k, (v, size) in self._entries.items()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class AssetDedup:
+    # Maps the index of an image or sound to the first index seen with the same table offset or, failing that, the
+    # same encoded bytes, so the caches hold one decoded copy of duplicates. Also totals what sharing saved.
+    def __init__(self):
+        self._index = {} # (kind, index) -> shared index
+        self._offsets = {} # (kind, offset) -> shared index
+        self._hashes = {} # (kind, digest) -> shared index
+        self._served = set()
+        self.load_times = {} # (kind, index) -> seconds its last decode took, disk cache hits don't count
+        self.saved = {} # kind -> {"duplicates", "bytes", "seconds"}
+
+    def shared(self, kind, index, locate):
+        # locate(index) -> (offset, encoded bytes), None if the asset doesn't exist
+        key = (kind, index)
+        shared = self._index.get(key)
+        if shared is None:
+            location = locate(index)
+            if location is None:
+                shared = index
+            else:
+                offset, payload = location
+                shared = self._offsets.get((kind, offset))
+                if shared is None:
+                    digest = hashlib.blake2b(payload, digest_size=16).digest()
+                    shared = self._hashes.setdefault((kind, digest), index)
+                    self._offsets[(kind, offset)] = shared
+            self._index[key] = shared
+        return shared
+
+    def served(self, kind, index, shared, nbytes):
+        # index got the asset of shared, the first time counts as the decode and the memory it saved
+        key = (kind, index)
+        if key in self._served:
+            return
+        self._served.add(key)
+        saved = self.saved.setdefault(kind, {"duplicates": 0, "bytes": 0, "seconds": 0.0})
+        saved["duplicates"] += 1
+        saved["bytes"] += nbytes
+        saved["seconds"] += self.load_times.get((kind, shared), 0.0)
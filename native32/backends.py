@@ -0,0 +1,220 @@
+import io
+import re
+from dataclasses import dataclass
+
+import pygame
+
+__all__ = ["Backends", "pygame_backends", "headless_backends", "parse_input_script", "KEYS",
+           "PygameVideo", "PygameAudio", "PygameInput", "PygameClock",
+           "OffscreenVideo", "NullAudio", "ScriptedInput", "VirtualClock"]
+
+# What N32Emu.run needs from the outside world, split so it can run without a display, sound card or real time.
+#   video: open(resolution) -> surface to draw each frame on, present(surface, rects=None) shows the rects that
+#          changed (None for all of it), close()
+#   audio: open(), channel_count(), play(channel, data), stop(channel), busy(channel), play_music(data, loops),
+#          stop_music(), music_busy(), close()
+#   input: poll() -> False once the user wants to quit, pressed() -> set of KEYS held down
+#   clock: tick(fps) waits for the next frame, now() -> milliseconds since start
+
+KEYS = ("left", "right", "up", "down", "z", "x")
+
+class PygameVideo:
+    def open(self, resolution):
+        pygame.init()
+        pygame.display.set_caption("n32emu")
+        return pygame.display.set_mode(resolution, flags=pygame.SCALED)
+
+    def present(self, surface, rects=None):
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
+    def close(self):
+        pygame.quit()
+
+class PygameAudio:
+    def __init__(self):
+        # has to happen before pygame.init()
+        pygame.mixer.pre_init(22050, -16, 1)
+
+    def open(self):
+        pygame.mixer.init(frequency=22050, size=-16, channels=1, buffer=512, allowedchanges=0)
+
+    def channel_count(self):
+        return pygame.mixer.get_num_channels()
+
+    def play(self, channel, data):
+        pygame.mixer.Channel(channel).play(pygame.mixer.Sound(buffer=data))
+
+    def stop(self, channel):
+        pygame.mixer.Channel(channel).stop()
+
+    def busy(self, channel):
+        return pygame.mixer.Channel(channel).get_busy()
+
+    def play_music(self, data, loops):
+        pygame.mixer.music.unload()
+        pygame.mixer.music.load(io.BytesIO(data), "mp3")
+        pygame.mixer.music.play(loops=loops)
+
+    def stop_music(self):
+        pygame.mixer.music.stop()
+
+    def music_busy(self):
+        return pygame.mixer.music.get_busy()
+
+    def close(self):
+        pass
+
+class PygameInput:
+    _KEY_CODES = {
+        "left": pygame.K_LEFT,
+        "right": pygame.K_RIGHT,
+        "up": pygame.K_UP,
+        "down": pygame.K_DOWN,
+        "z": pygame.K_z,
+        "x": pygame.K_x,
+    }
+
+    def poll(self):
+        running = True
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+        return running
+
+    def pressed(self):
+        keys = pygame.key.get_pressed()
+        return {name for name, code in self._KEY_CODES.items() if keys[code]}
+
+class PygameClock:
+    def __init__(self):
+        self._clock = pygame.time.Clock()
+
+    def tick(self, fps):
+        self._clock.tick(fps)
+
+    def now(self):
+        return pygame.time.get_ticks()
+
+class OffscreenVideo:
+    # Frames are drawn into a plain surface that is never shown
+    def __init__(self):
+        self.surface = None
+        self.frames = 0
+
+    def open(self, resolution):
+        self.surface = pygame.Surface(resolution)
+        return self.surface
+
+    def present(self, surface, rects=None):
+        self.frames += 1
+
+    def close(self):
+        pass
+
+class NullAudio:
+    # Nothing is played, but a sound stays busy for as long as it would have played on the emulator's clock, so
+    # movies waiting for their sound to end behave the same as with real audio
+    def __init__(self, clock, channels=8):
+        self.clock = clock
+        self.channels = channels
+        self._until = {}
+
+    def open(self):
+        pass
+
+    def channel_count(self):
+        return self.channels
+
+    def _play(self, key, duration_ms, loops):
+        self._until[key] = None if loops < 0 else self.clock.now() + duration_ms * (loops + 1)
+
+    def _busy(self, key):
+        if key not in self._until:
+            return False
+        until = self._until[key]
+        return until is None or self.clock.now() < until
+
+    def play(self, channel, data):
+        # 16-bit mono at the mixer's 22050Hz
+        self._play(channel, len(data) * 1000 // (2 * 22050), 0)
+
+    def stop(self, channel):
+        self._until.pop(channel, None)
+
+    def busy(self, channel):
+        return self._busy(channel)
+
+    def play_music(self, data, loops):
+        # assume 128kbps, the length of an MP3 isn't known without decoding it
+        self._play("music", len(data) * 8 // 128, loops)
+
+    def stop_music(self):
+        self._until.pop("music", None)
+
+    def music_busy(self):
+        return self._busy("music")
+
+    def close(self):
+        pass
+
+class ScriptedInput:
+    # script: list of (first_tick, last_tick, keys), see parse_input_script
+    def __init__(self, script=(), frames=None):
+        self.script = list(script)
+        self.frames = frames
+        self.tick = 0
+
+    def poll(self):
+        self.tick += 1
+        return self.frames is None or self.tick < self.frames
+
+    def pressed(self):
+        keys = set()
+        for first, last, held in self.script:
+            if first <= self.tick <= last:
+                keys |= held
+        return keys
+
+def parse_input_script(text):
+    # "10:z,20-25:left+z" holds z on tick 10 and left and z from tick 20 to 25
+    script = []
+    for item in text.split(","):
+        item = item.strip()
+        if item == "":
+            continue
+        m = re.fullmatch(r"(\d+)(?:-(\d+))?:([a-z+]+)", item)
+        assert m is not None, f"bad input script entry '{item}'"
+        first = int(m.group(1))
+        last = int(m.group(2)) if m.group(2) is not None else first
+        keys = set(m.group(3).split("+"))
+        assert keys <= set(KEYS), f"unknown keys in '{item}', expected some of {', '.join(KEYS)}"
+        script.append((first, last, keys))
+    return script
+
+class VirtualClock:
+    # Advances by exactly one frame per tick and never sleeps
+    def __init__(self):
+        self._now = 0
+
+    def tick(self, fps):
+        self._now += 1000 // fps
+
+    def now(self):
+        return self._now
+
+@dataclass
+class Backends:
+    video: object
+    audio: object
+    input: object
+    clock: object
+
+def pygame_backends():
+    return Backends(video=PygameVideo(), audio=PygameAudio(), input=PygameInput(), clock=PygameClock())
+
+def headless_backends(input_script=(), frames=None):
+    clock = VirtualClock()
+    return Backends(video=OffscreenVideo(), audio=NullAudio(clock), input=ScriptedInput(input_script, frames), clock=clock)
@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from image_cache import find_games
+from process_file import Native32Reader
+
+__all__ = ["BatchExtractor"]
+
+MANIFEST_VERSION = 1
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def _extract_one(path, out_dir, previous):
+    start = time.perf_counter()
+    size = os.path.getsize(path)
+    file_hash = _sha256_file(path)
+    if previous is not None and previous.get("status") == "ok" and previous.get("sha256") == file_hash:
+        return dict(previous, skipped=True)
+    entry = {"sha256": file_hash, "bytes": size}
+    out_dir = Path(out_dir)
+    try:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with open(out_dir / "extract.log", "w") as log, contextlib.redirect_stdout(log):
+            with open(path, "rb") as f:
+                r = Native32Reader(f, use_mmap=True)
+            r.run(out_dir)
+        entry["status"] = "ok"
+        entry["outputs"] = {str(p.relative_to(out_dir)): _sha256_file(p) for p in sorted(out_dir.rglob("*")) if p.is_file() and p.name != "extract.log"}
+    except Exception as e:
+        entry["status"] = "error"
+        entry["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    entry["skipped"] = False
+    return entry
+
+class BatchExtractor:
+    def __init__(self, out_root, manifest=None, jobs=1):
+        self.out_root = Path(out_root)
+        self.manifest_path = Path(manifest) if manifest is not None else self.out_root / "manifest.json"
+        self.jobs = jobs
+        self.files = {}
+        if self.manifest_path.is_file():
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.files = manifest["files"]
+
+    def save_manifest(self):
+        # written to a temp file and renamed, so an interrupted run never leaves a truncated manifest
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.manifest_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def run(self, libraries):
+        work = []
+        for root in libraries:
+            root = Path(root)
+            for path in find_games([root]):
+                rel = path.name if root.is_file() else str(path.relative_to(root))
+                work.append((rel, path))
+
+        start = time.perf_counter()
+        done = skipped = failed = 0
+        processed_bytes = 0
+        last_save = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {pool.submit(_extract_one, str(path), str(self.out_root / rel), self.files.get(rel)): rel for rel, path in work}
+            try:
+                for future in as_completed(futures):
+                    rel = futures[future]
+                    entry = future.result()
+                    self.files[rel] = entry
+                    if entry["skipped"]:
+                        skipped += 1
+                        status = "unchanged"
+                    else:
+                        done += 1
+                        processed_bytes += entry["bytes"]
+                        if entry["status"] != "ok":
+                            failed += 1
+                        status = entry["status"] if entry["status"] == "ok" else f"{entry['status']}: {entry['error']}"
+                    print(f"[{done + skipped}/{len(work)}] {rel}: {status}")
+                    if time.monotonic() - last_save > 5:
+                        self.save_manifest()
+                        last_save = time.monotonic()
+            finally:
+                # keep whatever finished, so the next run resumes from here
+                self.save_manifest()
+
+        elapsed = time.perf_counter() - start
+        print()
+        print(f"{done} files extracted ({failed} failed), {skipped} unchanged, in {elapsed:.1f}s")
+        if elapsed > 0:
+            print(f"Throughput: {done / elapsed:.2f} files/s, {processed_bytes / elapsed / (1024 * 1024):.2f} MB/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract every Native32 game in a library, resuming interrupted runs")
+    parser.add_argument("library", nargs="+", help="directories (or files) to scan for .smf/.sgm/.ssl games")
+    parser.add_argument("out_root", help="output directory, one subdirectory per game")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, default=0, help="worker processes, 0 for one per CPU (default: %(default)s)")
+    parser.add_argument("--manifest", metavar="FILE", help="manifest of per-file status (default: OUT_ROOT/manifest.json)")
+    args = parser.parse_args()
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    BatchExtractor(args.out_root, manifest=args.manifest, jobs=jobs).run(args.library)
+
+if __name__ == '__main__':
+    main()
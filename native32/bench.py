@@ -0,0 +1,343 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+from actions import Action
+from actionvm import ActionVM, Program
+from decode_image import decode_image_argb, decode_image_yuv, np
+from decrypt_header import do_decrypt, do_encrypt, decrypt_header
+from writer import random_image, stress_game
+
+__all__ = ["Result", "VM_SCENARIOS", "bench_vm", "bench_decode", "bench_decrypt", "bench_header", "bench_game",
+           "run_benchmarks", "compare_results"]
+
+@dataclass
+class Result:
+    name: str
+    value: float # always a rate, so higher is better
+    unit: str
+    info: dict = field(default_factory=dict)
+
+@contextlib.contextmanager
+def _quiet():
+    # the decoders and the reader print as they go
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        yield
+
+def _best_time(fn, repeat):
+    best = None
+    with _quiet():
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Action script throughput on hand-assembled loops, run against a stand-in reader/emulator so only the VM is measured
+
+class _ScriptReader:
+    def __init__(self, actions):
+        self.actions = [None] + actions
+        self._program = None
+
+    def get_action(self, index):
+        return self.actions[index] if 1 <= index < len(self.actions) else None
+
+    def get_program(self):
+        if self._program is None:
+            self._program = Program(self.actions)
+        return self._program
+
+class _NullEmu:
+    def __init__(self, reader):
+        self.r = reader
+
+    def get_property(self, target, prop):
+        return 0
+
+    def set_property(self, target, prop, value):
+        pass
+
+    def get_time(self):
+        return 0
+
+def _loop(body, count):
+    # i = 0; while i < count: body; i = i + 1
+    head = [(Action.Push, "i"), (Action.Push, "0"), (Action.SetVariable, None),
+            (Action.Push, "i"), (Action.GetVariable, None), (Action.Push, str(count)), (Action.Less, None), (Action.Not, None)]
+    tail = [(Action.Push, "i"), (Action.Push, "i"), (Action.GetVariable, None), (Action.Push, "1"), (Action.Add, None),
+            (Action.SetVariable, None)]
+    if_index = len(head) + 1
+    jump_index = if_index + len(body) + len(tail) + 1
+    end_index = jump_index + 1
+    actions = head + [(Action.If, end_index - if_index - 1)] + body + tail + [(Action.Jump, 4 - jump_index), (Action.End, None)]
+    ops_per_iteration = (len(head) - 3) + 1 + len(body) + len(tail) + 1
+    return actions, ops_per_iteration
+
+def _get(name):
+    return [(Action.Push, name), (Action.GetVariable, None)]
+
+VM_SCENARIOS = {
+    # x = (x + i * 3 - 1) / 2
+    "arith": [(Action.Push, "x"), *_get("x"), *_get("i"), (Action.Push, "3"), (Action.Multiply, None), (Action.Add, None),
+              (Action.Push, "1"), (Action.Subtract, None), (Action.Push, "2"), (Action.Divide, None), (Action.SetVariable, None)],
+    # t = length("abc" & i)
+    "string": [(Action.Push, "t"), (Action.Push, "abc"), *_get("i"), (Action.StringAdd, None), (Action.StringLength, None),
+               (Action.SetVariable, None)],
+    # if int(i / 2) * 2 == i
+    "branch": [*_get("i"), (Action.Push, "2"), (Action.Divide, None), (Action.ToInteger, None), (Action.Push, "2"),
+               (Action.Multiply, None), *_get("i"), (Action.Equals, None), (Action.If, 0)],
+}
+
+def bench_vm(scenario, iterations=2000, compiled=False, repeat=5):
+    actions, ops_per_iteration = _loop(VM_SCENARIOS[scenario], iterations)
+    vm = ActionVM(_NullEmu(_ScriptReader(actions)), compile_scripts=compiled)
+    return ops_per_iteration * iterations / _best_time(lambda: vm.run(1), repeat)
+
+DECODE_SCENARIOS = {
+    "argb": ("ARGB", decode_image_argb),
+    "yuv": ("_YUV", decode_image_yuv),
+}
+
+def bench_decode(colorspace, size=(320, 240), repeat=5):
+    # pixels per second
+    file_colorspace, decode = DECODE_SCENARIOS[colorspace]
+    data = random_image(file_colorspace, size[0], size[1], random.Random(1))
+    return size[0] * size[1] / _best_time(lambda: decode(data), repeat)
+
+def bench_decrypt(size=4096, repeat=5):
+    # bytes per second
+    data = random.Random(1).randbytes(size)
+    return size / _best_time(lambda: do_decrypt(data, b"aber3801"), repeat)
+
+def bench_header(count=100, repeat=5):
+    # encrypted headers found and decrypted per second, with the production key last in the list as in games
+    header = bytes(do_encrypt(struct.pack("<L4s6L", 0, b"8202", 1, 2, 3, 4, 5, 6), b"aber3801"))
+    def decrypt():
+        for i in range(count):
+            decrypt_header(header)
+    return count / _best_time(decrypt, repeat)
+
+def _headless_emu(game, frames, renderer=None):
+    from backends import headless_backends
+    from n32emu import N32Emu
+    backends = headless_backends(frames=frames)
+    with _quiet():
+        emu = N32Emu(game, backends=backends, renderer=renderer)
+    return emu, backends
+
+GAME_PARTS = ("tables.index", "tick", "draw", "blit", "render", "e2e")
+
+def bench_game(game, ticks=300, repeat=3, parts=GAME_PARTS):
+    # Table parsing, tick() and draw_frame() on a game already played for `ticks` ticks, ticks repainted by the
+    # damage renderer, and the whole headless emulator from a cold start
+    from process_file import Native32Reader
+    from table_index import TableIndex
+    results = []
+
+    if "tables.index" in parts:
+        with open(game, "rb") as f, _quiet():
+            reader = Native32Reader(f)
+            reader.init()
+        index = TableIndex(reader)
+        elapsed = _best_time(index.build, repeat)
+        results.append(Result("tables.index", 1 / elapsed, "indexes/s", {"frames": index.frame_count(), "bytes": index.nbytes()}))
+
+    if "tick" in parts or "draw" in parts or "blit" in parts:
+        emu, backends = _headless_emu(game, ticks)
+        with _quiet():
+            emu.run()
+
+    if "tick" in parts:
+        def tick():
+            for i in range(ticks):
+                emu.tick()
+                backends.clock.tick(30)
+                emu.time += 1000//30
+                if emu.reload is not None:
+                    emu.load_content(emu.reload)
+        elapsed = _best_time(tick, repeat)
+        results.append(Result("tick", ticks / elapsed, "ticks/s", {"movies": len(emu.movies)}))
+
+    if "draw" in parts:
+        screen = backends.video.surface
+        def draw():
+            for i in range(ticks):
+                screen.fill("black")
+                emu.draw_frame(screen)
+        elapsed = _best_time(draw, repeat)
+        sprites = len(emu.frame_images) + sum(1 for movie in emu.movies.values() if movie._visible)
+        results.append(Result("draw", ticks / elapsed, "frames/s", {"sprites": sprites, "culled": emu.viewport.culled}))
+
+    if "blit" in parts:
+        # one pass over the sprites on screen, from the decoded RGBA images, the ones converted to the screen's
+        # format, and with movies drawn from their atlases
+        from render import MovieAtlases, blit_list
+        screen = backends.video.surface
+        drawlist = emu.build_drawlist()
+        offset = (emu.screen_x, emu.screen_y)
+        rgba = {d.image: emu.r._decode_image(d.image) for d in drawlist}
+        scenes = (
+            ("rgba", blit_list(drawlist, rgba.get, offset)),
+            ("display", blit_list(drawlist, emu.r.get_image, offset)),
+            ("atlas", blit_list(drawlist, emu.r.get_image, offset, MovieAtlases(), emu.r.get_movie)),
+        )
+        for name, blits in scenes:
+            blits = [(img, rect, area) for key, img, rect, area in blits]
+            def blit():
+                for i in range(ticks):
+                    screen.blits(blits, doreturn=False)
+            elapsed = _best_time(blit, repeat)
+            results.append(Result(f"blit.{name}", ticks / elapsed, "frames/s", {"sprites": len(blits)}))
+
+    if "render" in parts:
+        from render import DamageRenderer
+        renderer = DamageRenderer()
+        emu, backends = _headless_emu(game, ticks, renderer)
+        with _quiet():
+            emu.run()
+        screen = backends.video.surface
+        def render():
+            for i in range(ticks):
+                emu.tick()
+                renderer.render(screen, emu.build_blitlist(), (emu.screen_x, emu.screen_y))
+                backends.clock.tick(30)
+                emu.time += 1000//30
+        elapsed = _best_time(render, repeat)
+        results.append(Result("render", ticks / elapsed, "frames/s",
+                              {"repainted": renderer.repainted / (renderer.frames * screen.get_width() * screen.get_height())}))
+
+    if "e2e" in parts:
+        def e2e():
+            emu, backends = _headless_emu(game, ticks)
+            emu.run()
+        elapsed = _best_time(e2e, repeat)
+        results.append(Result("e2e", ticks / elapsed, "ticks/s", {"game": os.path.basename(game)}))
+    return results
+
+# Synthetic games from writer.stress_game: tick and draw at a range of movie counts, and a large title for the
+# table parsing and end to end numbers
+MOVIE_COUNTS = (8, 32, 128)
+STRESS_GAME = dict(frames=1000, images=200, movies=32, clones=64, script_length=200)
+
+def bench_synthetic(ticks=300, wanted=lambda name: True):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for movies in MOVIE_COUNTS:
+            parts = [part for part in ("tick", "draw", "blit", "render") if wanted(f"{part}.movies{movies}")]
+            if not parts:
+                continue
+            game = os.path.join(tmp, f"movies{movies}.smf")
+            stress_game(frames=60, images=100, movies=movies, clones=0, script_length=50).write(game)
+            for r in bench_game(game, ticks, parts=parts):
+                results.append(Result(f"{r.name}.movies{movies}", r.value, r.unit, r.info))
+        parts = [part for part in ("tables.index", "e2e") if wanted(f"{part}.stress")]
+        if parts:
+            game = os.path.join(tmp, "stress.smf")
+            stress_game(**STRESS_GAME).write(game)
+            for r in bench_game(game, ticks, parts=parts):
+                results.append(Result(f"{r.name}.stress", r.value, r.unit, r.info))
+    return results
+
+def run_benchmarks(selected=None, game=None, iterations=2000, ticks=300):
+    # selected: names or name prefixes ("vm", "vm.arith", "decode.yuv"), None for everything
+    def wanted(name):
+        return selected is None or any(name == s or name.startswith(s + ".") for s in selected)
+
+    results = []
+    for colorspace in DECODE_SCENARIOS:
+        if wanted(f"decode.{colorspace}"):
+            results.append(Result(f"decode.{colorspace}", bench_decode(colorspace) / 1e6, "Mpix/s"))
+    if wanted("des.decrypt"):
+        results.append(Result("des.decrypt", bench_decrypt() / 1024, "KiB/s"))
+    if wanted("des.header"):
+        results.append(Result("des.header", bench_header(), "headers/s"))
+    for scenario in VM_SCENARIOS:
+        for compiled in (False, True):
+            name = f"vm.{scenario}.{'compiled' if compiled else 'interp'}"
+            if wanted(name):
+                results.append(Result(name, bench_vm(scenario, iterations, compiled) / 1e6, "Mops/s"))
+    results.extend(bench_synthetic(ticks, wanted))
+    if game is not None:
+        parts = [part for part in GAME_PARTS if wanted(part)]
+        if parts:
+            results.extend(bench_game(game, ticks, parts=parts))
+    return results
+
+def save_results(results, path, game=None):
+    doc = {
+        "python": platform.python_version(),
+        "numpy": np is not None,
+        "game": game,
+        "results": [{"name": r.name, "value": r.value, "unit": r.unit, **r.info} for r in results],
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=1)
+
+def load_results(path):
+    with open(path, "r") as f:
+        doc = json.load(f)
+    results = []
+    for entry in doc["results"]:
+        entry = dict(entry)
+        results.append(Result(entry.pop("name"), entry.pop("value"), entry.pop("unit"), entry))
+    return results
+
+def compare_results(baseline, current, threshold=10.0):
+    # Print the change of every benchmark in both runs, returns the names that got more than threshold % slower
+    before = {r.name: r for r in baseline}
+    regressions = []
+    for r in current:
+        if r.name not in before:
+            print(f"{r.name:22} {r.value:10.3f} {r.unit:10} (new)")
+            continue
+        old = before[r.name].value
+        change = (r.value - old) / old * 100 if old != 0 else 0.0
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(r.name)
+        print(f"{r.name:22} {old:10.3f} -> {r.value:10.3f} {r.unit:10} {change:+7.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Native32 emulator benchmarks")
+    parser.add_argument("benchmark", nargs="*", help="benchmarks to run by name or prefix, e.g. vm or decode.yuv (default: all)")
+    parser.add_argument("--game", metavar="GAME", help="also benchmark table parsing, tick, draw and the whole emulator on a real game")
+    parser.add_argument("--iterations", metavar="N", type=int, default=2000, help="VM loop iterations per run (default: %(default)s)")
+    parser.add_argument("--ticks", metavar="N", type=int, default=300, help="ticks per game benchmark run (default: %(default)s)")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against the results in BASELINE, exits with 1 on a regression")
+    parser.add_argument("--threshold", metavar="PCT", type=float, default=10.0, help="slowdown in %% counted as a regression (default: %(default)s)")
+    parser.add_argument("--load", metavar="FILE", help="compare the results in FILE instead of running the benchmarks")
+    args = parser.parse_args()
+
+    if args.load is not None:
+        if args.compare is None:
+            parser.error("--load requires --compare")
+        results = load_results(args.load)
+    else:
+        results = run_benchmarks(args.benchmark or None, game=args.game, iterations=args.iterations, ticks=args.ticks)
+        if args.compare is None:
+            for r in results:
+                print(f"{r.name:22} {r.value:10.3f} {r.unit}")
+        if args.json is not None:
+            save_results(results, args.json, game=args.game)
+
+    if args.compare is not None:
+        regressions = compare_results(load_results(args.compare), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,121 @@
 from pygame import image
 import struct
+import re
+from dataclasses import dataclass
+
+from tracing import TRACE, WARNING
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bump whenever decoded pixels change, so persisted decodes are invalidated
+DECODER_VERSION = 1
 
 def decode_image_yuv(data, yuv_dump=None):
     width, height, img_size = struct.unpack("<HHL", data[0:8])
+    # the chroma planes of odd-sized images don't line up with the luma plane, leave those to the reference decoder
+    if np is not None and width % 2 == 0 and height % 2 == 0:
+        return _decode_image_yuv_np(data, width, height, img_size, yuv_dump)
+    return _decode_image_yuv_py(data, width, height, img_size, yuv_dump)
+
+def _decode_image_yuv_np(data, width, height, img_size, yuv_dump=None):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    w2, h2 = width // 2, height // 2
+    total = w2 * h2
+
+    # Expand the RLE ops into spans of (source offset, quad count, source stride)
+    starts = []
+    counts = []
+    strides = []
+    pixel = 0
+    i = 8
+    while i < img_size+8 and pixel < total:
+        op = data[i] + (data[i+1] << 8)
+        assert op != 0x0, f"0x{i:08x}"
+        i += 2
+        if op & 0x8000 != 0:
+            # N quads of data
+            op &= ~0x8000
+            starts.append(i)
+            counts.append(op)
+            strides.append(6)
+            i += 6 * op
+        else:
+            # repeat N times
+            starts.append(i)
+            counts.append(op)
+            strides.append(0)
+            i += 6
+        pixel += op
+
+    y_2_2 = np.zeros((height, width), dtype=np.uint8)
+    u_1_1 = np.zeros((h2, w2), dtype=np.uint8)
+    v_1_1 = np.zeros((h2, w2), dtype=np.uint8)
+
+    if len(counts) > 0:
+        counts = np.array(counts, dtype=np.int64)
+        first = np.cumsum(counts) - counts
+        within = np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(first, counts)
+        offsets = np.repeat(np.array(starts, dtype=np.int64), counts) + np.repeat(np.array(strides, dtype=np.int64), counts) * within
+        offsets = offsets[:total]
+        quads = raw[offsets[:, None] + np.arange(6)]
+        n = len(quads)
+        # scatter into full rows of quads, anything past the last quad stays zero
+        quad_plane = np.zeros((total, 6), dtype=np.uint8)
+        quad_plane[:n] = quads
+        quad_plane = quad_plane.reshape(h2, w2, 6)
+        y_2_2[0::2, 0::2] = quad_plane[:, :, 0]
+        y_2_2[1::2, 0::2] = quad_plane[:, :, 1]
+        y_2_2[0::2, 1::2] = quad_plane[:, :, 2]
+        y_2_2[1::2, 1::2] = quad_plane[:, :, 3]
+        u_1_1[:] = quad_plane[:, :, 5]
+        v_1_1[:] = quad_plane[:, :, 4]
+
+    # Same zero-aware interpolation as _interpolate_y/_interpolate_x: a zero sample takes its neighbour
+    # (the previous one for even outputs, the next one for odd outputs), except at the edges
+    def _interpolate(plane, axis):
+        prev = np.roll(plane, 1, axis=axis)
+        nxt = np.roll(plane, -1, axis=axis)
+        if axis == 0:
+            prev[0, :] = plane[0, :]
+            nxt[-1, :] = plane[-1, :]
+        else:
+            prev[:, 0] = plane[:, 0]
+            nxt[:, -1] = plane[:, -1]
+        nonzero = plane != 0
+        result = np.empty_like(plane).repeat(2, axis=axis)
+        if axis == 0:
+            result[0::2, :] = np.where(nonzero, plane, prev)
+            result[1::2, :] = np.where(nonzero, plane, nxt)
+        else:
+            result[:, 0::2] = np.where(nonzero, plane, prev)
+            result[:, 1::2] = np.where(nonzero, plane, nxt)
+        return result
+
+    u_2_2 = _interpolate(_interpolate(u_1_1, 0), 1)
+    v_2_2 = _interpolate(_interpolate(v_1_1, 0), 1)
+
+    if yuv_dump is not None:
+        yuv_dump.write(y_2_2.tobytes())
+        yuv_dump.write(u_2_2.tobytes())
+        yuv_dump.write(v_2_2.tobytes())
+
+    # YUV to RGB, same integer approximation as the reference decoder
+    C = y_2_2.astype(np.int32) - 16
+    D = u_2_2.astype(np.int32) - 128
+    E = v_2_2.astype(np.int32) - 128
+    out = np.empty((height, width, 4), dtype=np.uint8)
+    out[:, :, 3] = 255
+    out[:, :, 2] = np.clip((298 * C           + 409 * E + 128) >> 8, 0, 255)
+    out[:, :, 1] = np.clip((298 * C - 100 * D - 208 * E + 128) >> 8, 0, 255)
+    out[:, :, 0] = np.clip((298 * C + 516 * D           + 128) >> 8, 0, 255)
+    out[y_2_2 == 0] = 0 # transparent
+
+    return image.frombytes(out.tobytes(), (width, height), "RGBA")
+
+def _decode_image_yuv_py(data, width, height, img_size, yuv_dump=None):
     out = bytearray(width * height * 4)
     y_2_2 = bytearray(width * height)
     u_1_1 = bytearray((width // 2) * (height // 2))
@@ -107,46 +220,116 @@ def decode_image_yuv(data, yuv_dump=None):
     # assert pixel == (width//2) * (height//2)
     return image.frombytes(bytes(out), (width, height), "RGBA")
 
-def decode_image_argb(data):
+class ImageDecodeError(ValueError):
+    pass
+
+# A span of literal 0x0000 (transparent) ops
+_ARGB_ZERO_RUN = re.compile(b'(?:\x00\x00)+')
+
+def _argb_word(value):
+    if value & 0x8000 == 0x0:
+        return b'\x00\x00\x00\x00'
+    return bytes((
+        ((value >> 10) & 0x1F) << 3, # B
+        ((value >> 5) & 0x1F) << 3, # G
+        ((value >> 0) & 0x1F) << 3, # R
+        255,
+    ))
+
+def _argb1555_word(value):
+    if value & 0x8000 == 0x0:
+        return b'\x00\x00'
+    return struct.pack("<H", value)
+
+def _decode_argb(data, strict, word_size, make_word):
+    # pixels as word_size byte words from make_word(16-bit value), all zero for transparent
     width, height, img_size = struct.unpack("<HHL", data[0:8])
-    out = bytearray(width * height * 4)
+    total = width * height
+    out = bytearray(total * word_size) # zero-initialised, i.e. transparent
+    words = {}
 
     pixel = 0
     i = 8
+    end = img_size + 8
 
-    def _putpixel(pix, value):
-        y = pix // width
-        x = pix % width
-        if value & 0x8000 == 0x0:
-            out[(y * width + x) * 4 + 3] = 0
-            out[(y * width + x) * 4 + 2] = 0
-            out[(y * width + x) * 4 + 1] = 0
-            out[(y * width + x) * 4 + 0] = 0
-        else:
-            out[(y * width + x) * 4 + 3] = 255
-            out[(y * width + x) * 4 + 2] = ((value >> 0) & 0x1F) << 3 # R
-            out[(y * width + x) * 4 + 1] = ((value >> 5) & 0x1F) << 3 # G
-            out[(y * width + x) * 4 + 0] = ((value >> 10) & 0x1F) << 3 # B
-
-    while i < img_size+8 and pixel < (width * height):
+    while i < end and pixel < total:
         op = data[i] | (data[i+1] << 8)
         if op == 0x0:
-            # literal 0
-            _putpixel(pixel, 0)
-            pixel += 1
-            i += 2
+            # literal 0, consume the whole span of them at once
+            m = _ARGB_ZERO_RUN.match(data, i, end)
+            count = min((m.end() - i) // 2 if m else 1, total - pixel)
+            pixel += count
+            i += 2 * count
         elif op & 0xc000 == 0xc000:
             # repeat N times
             value = data[i + 2] | (data[i + 3] << 8)
-            for j in range(op & 0x3fff):
-                _putpixel(pixel, value)
-                pixel += 1
+            count = min(op & 0x3fff, total - pixel)
+            if value & 0x8000 != 0x0:
+                word = words.get(value)
+                if word is None:
+                    word = words[value] = make_word(value)
+                out[pixel*word_size:(pixel+count)*word_size] = word * count
+            pixel += count
             i += 4
         else:
-            assert False, f"0x{op:04x} at 0x{i:06x}"
+            if strict:
+                raise ImageDecodeError(f"unknown ARGB op 0x{op:04x} at 0x{i:06x}")
+            TRACE.emit("asset", WARNING, f"unknown ARGB op 0x{op:04x} at 0x{i:06x}, leaving the rest of the {width}x{height} image transparent",
+                       op=op, offset=i, width=width, height=height)
+            break
+
+    return width, height, out
 
+def decode_image_argb(data, strict=False):
+    width, height, out = _decode_argb(data, strict, 4, _argb_word)
     return image.frombytes(bytes(out), (width, height), "RGBA")
 
+@dataclass
+class ARGB1555Image:
+    # An ARGB image kept in the game's own 16 bits per pixel (little-endian, 0 for transparent), half the memory of
+    # the RGBA surface. Enough of the Surface API for the caches, expand() makes the surface to blit.
+    width: int
+    height: int
+    pixels: bytes
+
+    def get_size(self):
+        return (self.width, self.height)
+
+    def get_bytesize(self):
+        return 2
+
+    def expand(self):
+        if np is not None:
+            out = _expand_argb1555_np(self.pixels)
+        else:
+            out = _expand_argb1555_py(self.pixels)
+        return image.frombytes(out, (self.width, self.height), "RGBA")
+
+def _expand_argb1555_np(pixels):
+    words = np.frombuffer(pixels, dtype="<u2")
+    out = np.empty((len(words), 4), dtype=np.uint8)
+    out[:, 0] = ((words >> 10) & 0x1F) << 3
+    out[:, 1] = ((words >> 5) & 0x1F) << 3
+    out[:, 2] = (words & 0x1F) << 3
+    out[:, 3] = 255
+    out[words & 0x8000 == 0] = 0
+    return out.tobytes()
+
+def _expand_argb1555_py(pixels):
+    words = {}
+    out = []
+    for value, in struct.iter_unpack("<H", pixels):
+        word = words.get(value)
+        if word is None:
+            word = words[value] = _argb_word(value)
+        out.append(word)
+    return b"".join(out)
+
+def decode_image_argb1555(data, strict=False):
+    # same pixels as decode_image_argb once expanded
+    width, height, out = _decode_argb(data, strict, 2, _argb1555_word)
+    return ARGB1555Image(width, height, bytes(out))
+
 def main():
     import sys
     with open(sys.argv[1], 'rb') as f:
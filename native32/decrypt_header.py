@@ -1,78 +1,106 @@
 import struct
 import sys
+from functools import lru_cache
 from des_constants import *
 
-
-def _expand_bits(data, count):
-    result = bytearray(count)
-    for i in range(count):
-        result[i] = (data[i >> 3] >> (i & 7)) & 1
-    return result
-
-def _compress_bits(data, count):
-    result = bytearray(count // 8)
-    for i in range(count):
-        result[i >> 3] |= data[i] << (i & 7)
-    return result
-
-def _do_shuffle(dst, src, table, count, offset = 0):
-    temp = bytearray(count)
-    for i in range(count):
-        temp[i] = src[table[i] - 1]
-    for i in range(count):
-        dst[i + offset] = temp[i]
-
-def _slice_and_dice(src, count, splitpoint, offset = 0):
-    shuffle_temp = bytearray(src[offset:offset+splitpoint])
-    for i in range(count - splitpoint):
-        src[offset + i] = src[offset + i + splitpoint]
-    for i in range(splitpoint):
-        src[offset + i + (count - splitpoint)] = shuffle_temp[i]
-
-def _expand_key(src):
-    key_bits = _expand_bits(src, 0x40)
-    _do_shuffle(key_bits, key_bits, INITIAL_KEY_PERMUTATION, 0x38)
-    result = bytearray(0x30*0x10)
-    for i in range(0x10):
-        splitpoint = KEY_SHIFT_SIZES[i]
-        _slice_and_dice(key_bits, 0x1c, splitpoint)
-        _slice_and_dice(key_bits, 0x1c, splitpoint, 0x1c)
-        _do_shuffle(result, key_bits, SUB_KEY_PERMUTATION, 0x30, i * 0x30)
-    return result
-
-def _do_xor(data, key, count):
-    for i in range(count):
-        data[i] = data[i] ^ key[i]
-
-def _do_sbox(data, key):
+# Table-driven version of the (nonstandard) Native32 DES. Blocks are handled as little-endian integers, so bit i
+# of the integer is bit (i & 7) of byte (i >> 3) - the same bit numbering the permutation tables use.
+
+def _perm_tables(table, in_bits):
+    # Output bit i is input bit table[i]-1. Split the input into bytes and precompute the permuted
+    # contribution of every value of each byte, so a permutation is one lookup per input byte.
+    contrib = [0] * in_bits
+    for i, src in enumerate(table):
+        contrib[src - 1] |= 1 << i
+    tables = []
+    for b in range(in_bits // 8):
+        t = [0] * 256
+        for v in range(1, 256):
+            low = (v & -v).bit_length() - 1
+            t[v] = t[v & (v - 1)] | contrib[b * 8 + low]
+        tables.append(t)
+    return tables
+
+def _permute(x, tables):
+    out = 0
+    for t in tables:
+        out |= t[x & 0xFF]
+        x >>= 8
+    return out
+
+def _sp_tables():
+    # S-box lookup followed by the right sub-message permutation, per 6-bit S-box input
+    p = _perm_tables(RIGHT_SUB_MESSAGE_PERMUTATION, 32)
+    tables = []
     for i in range(8):
-        k = key[i*6:(i+1)*6]
-        idx = (i * 4 + k[5] + k[0] * 2) * 0x10 + (k[4] + k[1] * 8 + k[2] * 4 + k[3] * 2)
-        bits = _expand_bits(DES_SBOXES[idx:idx+1], 4)
-        for j in range(4):
-            data[i*4+j] = bits[j]
-
-def _process_iteration(data, key):
-    iter_temp = bytearray(0x30)
-    _do_shuffle(iter_temp, data, MESSAGE_SHUFFLE, 0x30)
-    _do_xor(iter_temp, key, 0x30)
-    _do_sbox(data, iter_temp)
-    _do_shuffle(data, data, RIGHT_SUB_MESSAGE_PERMUTATION, 0x20)
+        t = []
+        for six in range(64):
+            k = [(six >> j) & 1 for j in range(6)]
+            idx = (i * 4 + k[5] + k[0] * 2) * 0x10 + (k[4] + k[1] * 8 + k[2] * 4 + k[3] * 2)
+            t.append(_permute(DES_SBOXES[idx] << (4 * i), p))
+        tables.append(t)
+    return tables
+
+def _inverse(table):
+    inv = [0] * len(table)
+    for i, src in enumerate(table):
+        inv[src - 1] = i + 1
+    return inv
+
+_INITIAL_MESSAGE = _perm_tables(INITIAL_MESSAGE_PERMUTATION, 64)
+_FINAL_MESSAGE = _perm_tables(FINAL_MESSAGE_PERMUTATION, 64)
+# for encryption, which runs the rounds backwards
+_INITIAL_MESSAGE_INV = _perm_tables(_inverse(INITIAL_MESSAGE_PERMUTATION), 64)
+_FINAL_MESSAGE_INV = _perm_tables(_inverse(FINAL_MESSAGE_PERMUTATION), 64)
+_MESSAGE_SHUFFLE = _perm_tables(MESSAGE_SHUFFLE, 32)
+_INITIAL_KEY = _perm_tables(INITIAL_KEY_PERMUTATION, 64)
+_SUB_KEY = _perm_tables(SUB_KEY_PERMUTATION, 56)
+_SP = _sp_tables()
+
+@lru_cache(maxsize=None)
+def _expand_key(key):
+    key_bits = _permute(int.from_bytes(key, 'little'), _INITIAL_KEY)
+    c = key_bits & 0xFFFFFFF
+    d = key_bits >> 28
+    result = []
+    for shift in KEY_SHIFT_SIZES:
+        c = (c >> shift) | ((c << (28 - shift)) & 0xFFFFFFF)
+        d = (d >> shift) | ((d << (28 - shift)) & 0xFFFFFFF)
+        result.append(_permute(c | (d << 28), _SUB_KEY))
+    return tuple(result)
+
+def _feistel(half, subkey):
+    x = _permute(half, _MESSAGE_SHUFFLE) ^ subkey
+    sp = _SP
+    return (sp[0][x & 0x3F] | sp[1][(x >> 6) & 0x3F] | sp[2][(x >> 12) & 0x3F] | sp[3][(x >> 18) & 0x3F] |
+            sp[4][(x >> 24) & 0x3F] | sp[5][(x >> 30) & 0x3F] | sp[6][(x >> 36) & 0x3F] | sp[7][(x >> 42) & 0x3F])
 
 def _decrypt_chunk(src, expanded_key):
-    expanded_data = _expand_bits(src, 0x40)
-    _do_shuffle(expanded_data, expanded_data, INITIAL_MESSAGE_PERMUTATION, 0x40)
-    for i in range(0x2d0, -1, -0x30):
-        temp_data = bytearray(expanded_data[:0x20])
-        _process_iteration(expanded_data, expanded_key[i:i+0x30])
-        _do_xor(expanded_data, expanded_data[0x20:0x40], 0x20)
-        for j in range(0x20):
-            expanded_data[0x20+j] = temp_data[j]
-    _do_shuffle(expanded_data, expanded_data, FINAL_MESSAGE_PERMUTATION, 0x40)
-    return _compress_bits(expanded_data, 0x40)
+    data = _permute(int.from_bytes(src, 'little'), _INITIAL_MESSAGE)
+    left = data & 0xFFFFFFFF
+    right = data >> 32
+    for subkey in reversed(expanded_key):
+        left, right = _feistel(left, subkey) ^ right, left
+    return _permute(left | (right << 32), _FINAL_MESSAGE).to_bytes(8, 'little')
+
+def _encrypt_chunk(src, expanded_key):
+    data = _permute(int.from_bytes(src, 'little'), _FINAL_MESSAGE_INV)
+    left = data & 0xFFFFFFFF
+    right = data >> 32
+    for subkey in expanded_key:
+        left, right = right, _feistel(right, subkey) ^ left
+    return _permute(left | (right << 32), _INITIAL_MESSAGE_INV).to_bytes(8, 'little')
+
+def do_encrypt(data, key):
+    assert len(data) % 8 == 0, "data must be whole 8 byte blocks"
+    expanded_key = _expand_key(bytes(key))
+    result = bytearray()
+    for i in range(len(data) // 8):
+        result.extend(_encrypt_chunk(data[i*8:(i+1)*8], expanded_key))
+    return result
 
 def do_decrypt(data, key):
-    expanded_key = _expand_key(key)
+    expanded_key = _expand_key(bytes(key))
     result = bytearray()
     for i in range(len(data) // 8):
         result.extend(_decrypt_chunk(data[i*8:(i+1)*8], expanded_key))
@@ -82,10 +110,12 @@ def decrypt_header(data):
     keys = b'1111111122222222aaaaaaaabbbbbbbbaber3801'
     for i in range(5):
         key = keys[i*8:(i+1)*8]
-        decrypted = do_decrypt(data, key)
-        if decrypted[4:8] == b'8202':
+        expanded_key = _expand_key(key)
+        # the check string lives in the first block, so reject wrong keys before decrypting the rest
+        first = _decrypt_chunk(data[0:8], expanded_key)
+        if first[4:8] == b'8202':
             print(f"using key {key}")
-            return decrypted
+            return bytearray(first) + do_decrypt(data[8:], key)
     assert False, "key not found"
 
 
@@ -0,0 +1,156 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from pathlib import Path
+
+from pygame import image
+
+from decode_image import DECODER_VERSION
+
+__all__ = ["ImageDiskCache", "hash_game_data", "find_games", "warm_library", "GAME_SUFFIXES"]
+
+GAME_SUFFIXES = (".smf", ".sgm", ".ssl")
+
+# Entry layout: magic, decoder version, width, height, then RGBA pixels at _HEADER_SIZE
+_HEADER = "<4sHHH6x"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_MAGIC = b"N32C"
+
+def hash_game_data(data):
+    return hashlib.sha256(data).hexdigest()
+
+class ImageDiskCache:
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._total_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, file_hash, index):
+        return self.directory / file_hash[:2] / f"{file_hash}_{index}_v{DECODER_VERSION}.rgba"
+
+    def _entries(self):
+        return [p for p in self.directory.glob("*/*.rgba") if p.is_file()]
+
+    def get(self, file_hash, index):
+        path = self._path(file_hash, index)
+        try:
+            with open(path, "rb") as f:
+                # copy-on-write so the surface can never write back into the cache
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except ValueError:
+            # mmap refuses empty files
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+        if len(mm) < _HEADER_SIZE:
+            # truncated, e.g. by a crash while it was written
+            mm.close()
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+        magic, version, width, height = struct.unpack_from(_HEADER, mm, 0)
+        size = width * height * 4
+        if magic != _MAGIC or version != DECODER_VERSION or len(mm) != _HEADER_SIZE + size:
+            mm.close()
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+        # the surface keeps the mapping alive, pixels are only paged in when blitted
+        img = image.frombuffer(memoryview(mm)[_HEADER_SIZE:], (width, height), "RGBA")
+        try:
+            os.utime(path) # mtime is the LRU timestamp
+        except OSError:
+            pass
+        self.hits += 1
+        return img
+
+    def put(self, file_hash, index, img):
+        path = self._path(file_hash, index)
+        path.parent.mkdir(exist_ok=True)
+        width, height = img.get_size()
+        pixels = image.tobytes(img, "RGBA")
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(struct.pack(_HEADER, _MAGIC, DECODER_VERSION, width, height))
+                f.write(pixels)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        if self._total_bytes is None:
+            self._total_bytes = sum(p.stat().st_size for p in self._entries())
+        else:
+            self._total_bytes += _HEADER_SIZE + len(pixels) - replaced
+        if self.max_bytes is not None and self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self, target_bytes=None):
+        if target_bytes is None:
+            # evict a bit past the limit so we don't rescan on every put
+            target_bytes = self.max_bytes * 9 // 10
+        entries = []
+        for p in self._entries():
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort(key=lambda x: x[0])
+        total = sum(e[1] for e in entries)
+        for mtime, size, p in entries:
+            if total <= target_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
+
+def find_games(paths):
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            for p in sorted(path.rglob("*")):
+                if p.suffix.lower() in GAME_SUFFIXES and p.is_file():
+                    yield p
+        else:
+            yield path
+
+def warm_library(cache, paths):
+    from process_file import Native32Reader
+    for path in find_games(paths):
+        print(f"Warming {path}...")
+        with open(path, "rb") as f:
+            r = Native32Reader(f, image_cache=cache)
+        try:
+            r.init()
+        except AssertionError as e:
+            print(f"  skipped: {e}")
+            continue
+        count = r.image_count()
+        for index in range(1, count + 1):
+            r.get_image(index)
+        saved = r.dedup.saved.get("image")
+        if saved is not None:
+            print(f"  {count} images, {saved['duplicates']} duplicates shared, saving {saved['bytes'] // 1024}KiB and "
+                  f"{saved['seconds'] * 1000:.1f}ms of decoding")
+        else:
+            print(f"  {count} images")
+    print(f"Cache: {cache.hits} hits, {cache.misses} decoded, {cache.evictions} evicted")
+
+if __name__ == '__main__':
+    warm_library(ImageDiskCache(sys.argv[1]), sys.argv[2:])
@@ -1,8 +1,17 @@
 import sys, io
-import pygame
+import argparse
+import time
+import bisect
+import heapq
 from process_file import *
 from dataclasses import dataclass
 from actionvm import ActionVM, ActionProp
+from image_cache import ImageDiskCache, warm_library
+from prefetch import AssetPrefetcher
+from backends import pygame_backends, headless_backends, parse_input_script
+from render import DamageRenderer, StaticLayers, DisplayFormat, MovieAtlases, Viewport, blit_list
+import tracing
+from tracing import TRACE, DEBUG, INFO, WARNING
 from pathlib import Path
 
 @dataclass
@@ -18,6 +27,8 @@ class MovieState:
     _visible: bool = True
     _playing: bool = True
     _next_frame: int|None = 0
+    _draw: "DrawEntry|None" = None # its entry in the display list
+    _placed: tuple|None = None # (frame, x, y) _draw was last updated for
 
 @dataclass
 class DrawEntry:
@@ -25,14 +36,43 @@ class DrawEntry:
     x: int
     y: int
     depth: int
+    # display list order: (depth, 0 for images/1 for movies, position in the frame/movie dict)
+    key: tuple = ()
+    visible: bool = True
+    movie: int = 0 # the movie it belongs to, 0 for frame images
+
+def _display_key(entry):
+    return entry.key
 
 class N32Emu:
-    def __init__(self, filename):
+    def __init__(self, filename, image_cache=None, cache_budgets=None, prefetch_workers=0, use_mmap=False, backends=None,
+                 renderer=None, layer_budget=8 * 1024 * 1024, convert_surfaces=True, movie_atlases=False, compact_images=False):
         self.filename = filename
+        # None repaints the whole screen every frame
+        self.renderer = renderer
+        self.layer_budget = layer_budget # 0 draws every image of a frame separately
+        self.convert_surfaces = convert_surfaces
+        self.movie_atlases = movie_atlases
+        self.display_format = None
+        self.atlases = None
+        self.backends = backends if backends is not None else pygame_backends()
+        self.audio = self.backends.audio
+        self.input = self.backends.input
+        self.image_cache = image_cache
+        self.cache_budgets = cache_budgets
+        self.use_mmap = use_mmap
+        self.compact_images = compact_images
+        self.prefetch_workers = prefetch_workers
+        self.prefetcher = None
         with open(filename, "rb") as f:
-            self.r = Native32Reader(f)
+            self.r = Native32Reader(f, image_cache=image_cache, cache_budgets=cache_budgets, use_mmap=use_mmap,
+                                    compact_images=compact_images)
         self.r.init()
-        self.movies = {}
+        self.r.build_index()
+        self.layers = StaticLayers(self.r.resolution, self.layer_budget) if self.layer_budget > 0 else None
+        self.viewport = Viewport(self.r.resolution, self.r.get_image_size)
+        self.culled = 0 # draw entries left out for being off the screen, over all ticks
+        self.reset_movies()
         self._playing = True
         self._next_frame = 1
         self.frame = 0
@@ -41,8 +81,59 @@ class N32Emu:
         self.screen_x = 0
         self.screen_y = 0
 
+    def reset_movies(self):
+        self.movies = {}
+        self.frame_images = []
+        # Everything drawn, kept sorted by DrawEntry.key. That is the order a stable sort by depth of the frame's
+        # images followed by the movies in self.movies gives, so ties draw in the same order as they always did.
+        self.display_list = []
+        self._movie_seq = 0
+
+    def _display_remove(self, entry):
+        i = bisect.bisect_left(self.display_list, entry.key, key=_display_key)
+        assert self.display_list[i] is entry
+        del self.display_list[i]
+
+    def add_movie(self, name, movie):
+        old = self.movies.get(name)
+        if old is not None:
+            # replacing a movie keeps its place in the dict
+            seq = old._draw.key[2]
+            self._display_remove(old._draw)
+        else:
+            seq = self._movie_seq
+            self._movie_seq += 1
+        movie._draw = DrawEntry(0, 0, 0, movie.depth, key=(movie.depth, 1, seq), visible=False, movie=movie.movie)
+        self.movies[name] = movie
+        bisect.insort(self.display_list, movie._draw, key=_display_key)
+
+    def remove_movie(self, name):
+        movie = self.movies.pop(name)
+        self._display_remove(movie._draw)
+
+    def stop_prefetcher(self):
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+            self.prefetcher = None
+
+    def start_prefetcher(self):
+        self.stop_prefetcher()
+        if self.prefetch_workers > 0:
+            self.prefetcher = AssetPrefetcher(self.r, workers=self.prefetch_workers)
+            self.prefetcher.schedule(self.frame)
+
     def load_frame(self, i):
         self.cur_frame = self.r.get_frame(i)
+        if self.prefetcher is not None:
+            # get the likely next scenes decoding while this one plays
+            self.prefetcher.schedule(i)
+        # the per-tick loops only need these, so split them out once per frame
+        images = [obj for obj in self.cur_frame if obj.obj_type == ObjectType.Image]
+        self.frame_images = [DrawEntry(obj.index, obj.x, obj.y, obj.depth, key=(obj.depth, 0, i)) for i, obj in enumerate(images)]
+        self.display_list = list(heapq.merge((d for d in self.display_list if d.key[1] == 1),
+                                             sorted(self.frame_images, key=_display_key), key=_display_key))
+        self.frame_actions = [obj.index for obj in self.cur_frame if obj.obj_type == ObjectType.Action]
+        self.frame_buttons = [obj.index for obj in self.cur_frame if obj.obj_type == ObjectType.Button]
         # Update movie list
         frame_movies = set()
         for obj in self.cur_frame:
@@ -52,32 +143,61 @@ class N32Emu:
                 if obj.name in self.movies:
                     # Don't add/reset movies that already exist
                     continue
-                self.movies[obj.name] = MovieState(movie=obj.index, x=obj.x, y=obj.y, depth=obj.depth)
+                self.add_movie(obj.name, MovieState(movie=obj.index, x=obj.x, y=obj.y, depth=obj.depth))
         delete_movies = []
         for movie_name, movie in self.movies.items():
             if movie_name not in frame_movies and not movie._cloned_sprite:
                 delete_movies.append(movie_name)
         for movie in delete_movies:
-            del self.movies[movie]
+            self.remove_movie(movie)
         # TODO: button, sound
 
-    def draw_frame(self, screen):
-        drawlist = []
-        for obj in self.cur_frame:
-            if obj.obj_type == ObjectType.Image:
-                drawlist.append(DrawEntry(obj.index, obj.x, obj.y, obj.depth))
+    def build_drawlist(self):
+        # bring the movies' entries up to date, the display list is already in order
         for movie in self.movies.values():
+            d = movie._draw
             if not movie._visible:
+                d.visible = False
+                movie._placed = None
+                continue
+            placed = (movie.frame, movie.x, movie.y)
+            if placed == movie._placed:
                 continue
+            movie._placed = placed
             movie_frames = self.r.get_movie(movie.movie)
-            if movie.frame >= 0 and movie.frame < len(movie_frames):
-                frame = movie_frames[movie.frame]
-                drawlist.append(DrawEntry(frame.image, movie.x + frame.x, movie.y + frame.y, movie.depth))
+            d.visible = movie.frame >= 0 and movie.frame < len(movie_frames)
+            if d.visible:
+                i = movie.frame
+                d.image = movie_frames.image[i]
+                d.x = movie.x + movie_frames.x[i]
+                d.y = movie.y + movie_frames.y[i]
+        return [d for d in self.display_list if d.visible]
+
+    def build_blitlist(self):
+        offset = (self.screen_x, self.screen_y)
+        self.viewport.culled = 0
+        if self.layers is not None:
+            blits = self.layers.collapse(self.build_drawlist(), self.r.get_image, offset, self.frame, self.atlases, self.r.get_movie,
+                                         self.viewport)
+        else:
+            blits = blit_list(self.build_drawlist(), self.r.get_image, offset, self.atlases, self.r.get_movie, self.viewport)
+        self.culled += self.viewport.culled
+        if TRACE.frame and self.viewport.culled > 0:
+            TRACE.emit("frame", DEBUG, f"culled {self.viewport.culled} off-screen entries", culled=self.viewport.culled)
+        return blits
 
-        drawlist.sort(key = lambda x: x.depth)
-        for d in drawlist:
-            img = self.r.get_image(d.image)
-            screen.blit(img, (self.screen_x + d.x, self.screen_y + d.y))
+    def draw_frame(self, screen):
+        screen.blits([(img, rect, area) for key, img, rect, area in self.build_blitlist()], doreturn=False)
+
+    def set_display_format(self, screen):
+        # images are converted to the screen's pixel format from now on
+        self.display_format = DisplayFormat(screen)
+        if self.movie_atlases:
+            self.atlases = MovieAtlases()
+        self.r.set_image_converter(self.display_format)
+        if self.layers is not None:
+            self.layers.convert = self.display_format
+            self.layers.clear()
 
     def play_sound(self, sound, movie):
         repeat = (sound >> 8) & 0xFF
@@ -89,24 +209,29 @@ class N32Emu:
             channel = len(self.channel_movie) - 1
             self.stop_channel(channel)
 
-            pygame.mixer.music.unload()
-            pygame.mixer.music.load(io.BytesIO(data), "mp3")
-            pygame.mixer.music.play(loops=repeat)
+            self.audio.play_music(data, repeat)
 
             self.channel_movie[channel] = movie
+            if TRACE.sound:
+                TRACE.emit("sound", INFO, f"   play_sound({index}, mp3, repeat={repeat}) on music for {movie}", sound=index, channel=channel, movie=movie)
             return channel
 
         elif fmt == AudioFormat.RAW:
             for i in range(len(self.channel_movie) - 1):
                 if self.channel_movie[i] is None: # find a free channel
-                    pygame.mixer.Channel(i).play(pygame.mixer.Sound(buffer=data))
+                    self.audio.play(i, data)
                     self.channel_movie[i] = movie
+                    if TRACE.sound:
+                        TRACE.emit("sound", INFO, f"   play_sound({index}, raw) on channel {i} for {movie}", sound=index, channel=i, movie=movie)
                     return i
+            if TRACE.sound:
+                TRACE.emit("sound", WARNING, f"   play_sound({index}) dropped, no free channel", sound=index, movie=movie)
 
         return None
 
     def tick(self):
         self.ticks += 1
+        TRACE.tick = self.ticks
 
         if self._next_frame is None and self._playing:
             self._next_frame = self.frame + 1
@@ -116,9 +241,8 @@ class N32Emu:
             self.load_frame(self.frame)
 
 
-        for obj in self.cur_frame:
-            if obj.obj_type == ObjectType.Action:
-                self.vm.run(obj.index, "")
+        for action in self.frame_actions:
+            self.vm.run(action, "")
 
         for movie_name, movie in self.movies.items():
             movie_frames = self.r.get_movie(movie.movie)
@@ -136,49 +260,54 @@ class N32Emu:
                 if movie._next_frame < len(movie_frames):
                     movie.frame = movie._next_frame
                     movie._next_frame = None
-                    if movie_frames[movie.frame].sound != 0:
-                        movie._sound_channel = self.play_sound(movie_frames[movie.frame].sound, movie_name)
-                    if movie_frames[movie.frame].action != 0:
-                        self.vm.run(movie_frames[movie.frame].action, movie_name)
+                    sound = movie_frames.sound[movie.frame]
+                    if sound != 0:
+                        movie._sound_channel = self.play_sound(sound, movie_name)
+                    action = movie_frames.action[movie.frame]
+                    if action != 0:
+                        self.vm.run(action, movie_name)
 
         # Handle "buttons"
-        keys = pygame.key.get_pressed()
+        keys = self.input.pressed()
         key_map = {
-            0x0200: pygame.K_LEFT,
-            0x0400: pygame.K_RIGHT,
-            0x1c00: pygame.K_UP,
-            0x1e00: pygame.K_DOWN,
-            0x4000: pygame.K_z,
-            0x8800: pygame.K_x,
+            0x0200: "left",
+            0x0400: "right",
+            0x1c00: "up",
+            0x1e00: "down",
+            0x4000: "z",
+            0x8800: "x",
         }
-        for obj in self.cur_frame:
-            if obj.obj_type == ObjectType.Button:
-                events = self.r.get_button_events(obj.index)
-                for keycode, action in events:
-                    if keycode in key_map and keys[key_map[keycode]]:
-                        self.vm.run(action, "")
+        for button in self.frame_buttons:
+            events = self.r.get_button_events(button)
+            for keycode, action in events:
+                if keycode in key_map and key_map[keycode] in keys:
+                    self.vm.run(action, "")
 
         # Handle ended sounds
         for i, movie in enumerate(self.channel_movie):
             if i == len(self.channel_movie) - 1:
-                if pygame.mixer.music.get_busy():
+                if self.audio.music_busy():
                     continue
             else:
-                if pygame.mixer.Channel(i).get_busy():
+                if self.audio.busy(i):
                     continue
             if movie is not None:
-                self.movies[movie]._sound_channel = None
+                # the movie may have been removed while its sound was still playing
+                if movie in self.movies:
+                    self.movies[movie]._sound_channel = None
                 self.channel_movie[i] = None
 
     def stop(self, target):
-        print(f"   stop({target})")
+        if TRACE.frame:
+            TRACE.emit("frame", DEBUG, f"   stop({target})", target=target)
         if target == "":
             self._playing = False
         else:
             self.movies[target]._playing = False
 
     def play(self, target):
-        print(f"   play({target})")
+        if TRACE.frame:
+            TRACE.emit("frame", DEBUG, f"   play({target})", target=target)
         if target == "":
             self._playing = True
         else:
@@ -191,7 +320,8 @@ class N32Emu:
             return self.movies[target].frame + 1
 
     def goto_frame(self, target, frame, playing=False):
-        print(f"   goto_frame({target}, {frame}, {playing})")
+        if TRACE.frame:
+            TRACE.emit("frame", DEBUG, f"   goto_frame({target}, {frame}, {playing})", target=target, frame=frame, playing=playing)
         if target == "":
             self._next_frame = frame
             self._playing = playing
@@ -201,11 +331,11 @@ class N32Emu:
 
     def stop_channel(self, i):
         if i == len(self.channel_movie) - 1:
-            pygame.mixer.music.stop()
+            self.audio.stop_music()
         else:
-            pygame.mixer.Channel(i).stop()
+            self.audio.stop(i)
         movie = self.channel_movie[i]
-        if movie is not None:
+        if movie is not None and movie in self.movies:
             self.movies[movie]._sound_channel = None
         self.channel_movie[i] = None
 
@@ -258,21 +388,23 @@ class N32Emu:
         elif prop == ActionProp.currentframe:
             m._next_frame = int(float(value))
         elif prop == ActionProp.name:
-            self.movies[value] = m
-            del self.movies[target]
+            # renaming a movie to its own name drops it, as it always has
+            self.remove_movie(target)
+            if value != target:
+                self.add_movie(value, m)
         else:
             assert False, (target, prop, value)
 
     def clone_sprite(self, src, dest, depth):
         orig = self.movies[src]
-        self.movies[dest] = MovieState(movie=orig.movie, x=orig.x, y=orig.y, depth=depth,
+        self.add_movie(dest, MovieState(movie=orig.movie, x=orig.x, y=orig.y, depth=depth,
             frame=-1, _visible=True, _playing=orig._playing, _next_frame=orig.frame,
-            _cloned_sprite=True)
+            _cloned_sprite=True))
     def remove_sprite(self, name):
         if name in self.movies:
             if self.movies[name]._sound_channel is not None:
                 self.stop_channel(self.movies[name]._sound_channel)
-            del self.movies[name]
+            self.remove_movie(name)
 
     def get_time(self):
         return self.time
@@ -298,27 +430,39 @@ class N32Emu:
         self.time = 0
         self.ticks = 0
         with open(fullpath, "rb") as f:
-            self.r = Native32Reader(f)
+            self.r = Native32Reader(f, image_cache=self.image_cache, cache_budgets=self.cache_budgets, use_mmap=self.use_mmap,
+                                    compact_images=self.compact_images)
         self.r.init()
-        self.movies = {}
+        self.r.build_index()
+        self.viewport = Viewport(self.r.resolution, self.r.get_image_size)
+        self.reset_movies()
         self._playing = True
         self._next_frame = 1
         self.frame = 0
         self.reload = None
         self.vm = ActionVM(self)
+        if self.display_format is not None:
+            self.r.set_image_converter(self.display_format)
+        if self.atlases is not None:
+            self.atlases.clear()
+        if self.layers is not None:
+            self.layers.clear()
+        if self.renderer is not None:
+            self.renderer.invalidate()
+        self.start_prefetcher()
 
     def load_data(self, data_var, success_var):
         if not Path(f"{self.filename}.ssl_sav").is_file():
-            self.vm.vars[success_var.lower()] = "N"
+            self.vm.set_var(success_var, "N")
             return
         with open(f"{self.filename}.ssl_sav", "r") as f:
-            self.vm.vars[data_var.lower()] = f.read()
-            self.vm.vars[success_var.lower()] = "S"
+            self.vm.set_var(data_var, f.read())
+            self.vm.set_var(success_var, "S")
 
     def save_data(self, data, success_var):
         with open(f"{self.filename}.ssl_sav", "w") as f:
             f.write(data)
-            self.vm.vars[success_var.lower()] = "S"
+            self.vm.set_var(success_var, "S")
 
     def get_url(self, url, target):
         target = target.split("+")
@@ -346,41 +490,142 @@ class N32Emu:
             assert False, f"Unhandled GetUrl2('{url}', '{target}')"
 
     def run(self):
-        pygame.mixer.pre_init(22050, -16, 1)
-        pygame.init()
-        pygame.display.set_caption("n32emu")
-        screen = pygame.display.set_mode(self.r.resolution, flags=pygame.SCALED)
-        clock = pygame.time.Clock()
+        video, clock = self.backends.video, self.backends.clock
+        screen = video.open(self.r.resolution)
+        # prefetched images have to be cached converted, so the prefetcher only starts once the screen exists
+        self.stop_prefetcher()
+        if self.convert_surfaces:
+            self.set_display_format(screen)
+        self.start_prefetcher()
+        self.audio.open()
         self.time = 0
         self.ticks = 0
-
-        pygame.mixer.init(frequency=22050, size=-16, channels=1, buffer=512, allowedchanges=0)
-        self.channel_movie = [None for i in range(pygame.mixer.get_num_channels() + 1)]
+        self.channel_movie = [None for i in range(self.audio.channel_count() + 1)]
 
         running = True
-        while running:
-            print(f"frame={self.frame} next={self._next_frame}")
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-
-            self.tick()
-
-            screen.fill("black")
-            self.draw_frame(screen)
-            pygame.display.flip()
+        try:
+            while running:
+                if TRACE.frame:
+                    TRACE.emit("frame", DEBUG, f"frame={self.frame} next={self._next_frame}", frame=self.frame, next=self._next_frame)
+                running = self.input.poll()
 
-            clock.tick(30)
-            self.time += 1000//30
+                self.tick()
 
-            if self.reload is not None:
-                self.load_content(self.reload)
-
-        pygame.quit()
+                if self.renderer is not None:
+                    rects = self.renderer.render(screen, self.build_blitlist(), (self.screen_x, self.screen_y))
+                    video.present(screen, rects)
+                else:
+                    screen.fill("black")
+                    self.draw_frame(screen)
+                    video.present(screen)
+
+                clock.tick(30)
+                self.time += 1000//30
+
+                if self.reload is not None:
+                    self.load_content(self.reload)
+        except BaseException:
+            TRACE.dump()
+            raise
+
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+        self.audio.close()
+        video.close()
+        return self.ticks
+
+    def print_cache_stats(self):
+        for category, stats in self.r.cache_stats().items():
+            budget = "unbounded" if stats["budget"] is None else f"{stats['budget'] // 1024}KiB"
+            print(f"{category:8} {stats['entries']:6} entries {stats['bytes'] // 1024:8}KiB / {budget:>10}  "
+                  f"hits={stats['hits']} misses={stats['misses']} evictions={stats['evictions']}")
+        memory = self.r.image_memory()
+        if self.r.compact_images and memory["rgba_bytes"] > 0:
+            saved = 100 * (1 - memory["bytes"] / memory["rgba_bytes"])
+            print(f"images   {memory['images']} decoded in {memory['bytes'] // 1024}KiB, {memory['rgba_bytes'] // 1024}KiB as RGBA "
+                  f"({saved:.0f}% saved)")
+        for kind, saved in self.r.dedup.saved.items():
+            print(f"dedup    {saved['duplicates']} duplicate {kind}s shared, saving {saved['bytes'] // 1024}KiB and "
+                  f"{saved['seconds'] * 1000:.1f}ms of decoding")
+        if self.layers is not None:
+            stats = self.layers.cache.stats()
+            print(f"layers   {stats['entries']:6} entries {stats['bytes'] // 1024:8}KiB / {stats['budget'] // 1024:>7}KiB  "
+                  f"hits={stats['hits']} misses={stats['misses']} evictions={stats['evictions']}")
+        if self.prefetcher is not None:
+            stats = self.prefetcher.stats()
+            print(f"prefetch {stats['prefetched']} assets prefetched, {stats['used']} used, {stats['failed']} failed")
 
 def main():
-    emu = N32Emu(sys.argv[1])
-    emu.run()
+    parser = argparse.ArgumentParser(description="Sunplus Native32 interpreter")
+    parser.add_argument("game", nargs="?", help="game file (.smf/.sgm/.ssl)")
+    parser.add_argument("--image-cache", metavar="DIR", help="persist decoded images in DIR across runs")
+    parser.add_argument("--image-cache-size", metavar="MB", type=int, default=512, help="size cap of the image cache (default: %(default)s)")
+    parser.add_argument("--warm-cache", metavar="LIBRARY", nargs="+", help="decode every image of the games in LIBRARY into the image cache and exit")
+    for category in ("images", "sounds", "frames", "movies"):
+        parser.add_argument(f"--{category[:-1]}-budget", metavar="MB", type=float, help=f"memory budget for decoded {category} (default: unbounded)")
+    parser.add_argument("--compact-images", action="store_true", help="keep decoded ARGB images at 16 bits per pixel, expanding them only to draw")
+    parser.add_argument("--expanded-budget", metavar="MB", type=float, help="memory for images expanded from --compact-images (default: 8)")
+    parser.add_argument("--layer-budget", metavar="MB", type=float, default=8, help="memory for pre-composited static frame layers, 0 to disable (default: %(default)s)")
+    parser.add_argument("--raw-surfaces", action="store_true", help="blit images as decoded, without converting them to the screen's format")
+    parser.add_argument("--movie-atlases", action="store_true", help="pack the small images of each movie into a shared surface")
+    parser.add_argument("--cache-stats", action="store_true", help="print asset cache hit/miss/eviction counters on exit")
+    parser.add_argument("--mmap", action="store_true", help="memory-map game files instead of reading them into memory")
+    parser.add_argument("--prefetch", metavar="N", type=int, default=1, help="background threads predecoding upcoming scenes, 0 to disable (default: %(default)s)")
+    parser.add_argument("--headless", action="store_true", help="run without a window, sound or frame limiting, and report the emulation speed")
+    parser.add_argument("--frames", metavar="N", type=int, help="stop after N frames (headless only)")
+    parser.add_argument("--input", metavar="SCRIPT", default="", help="keys for headless runs, e.g. '10:z,20-25:left+z' holds z on frame 10 and left and z on frames 20-25")
+    parser.add_argument("--full-redraw", action="store_true", help="repaint the whole screen every frame instead of only what changed")
+    parser.add_argument("--show-damage", action="store_true", help="outline the areas repainted each frame")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure(args)
+
+    image_cache = None
+    if args.image_cache is not None:
+        image_cache = ImageDiskCache(args.image_cache, max_bytes=args.image_cache_size * 1024 * 1024)
+    if args.warm_cache is not None:
+        if image_cache is None:
+            parser.error("--warm-cache requires --image-cache")
+        warm_library(image_cache, args.warm_cache)
+        return
+    if args.game is None:
+        parser.error("no game file given")
+
+    cache_budgets = {}
+    for category in ("images", "sounds", "frames", "movies"):
+        budget = getattr(args, f"{category[:-1]}_budget")
+        if budget is not None:
+            cache_budgets[category] = int(budget * 1024 * 1024)
+    if args.expanded_budget is not None:
+        cache_budgets["expanded"] = int(args.expanded_budget * 1024 * 1024)
+
+    if args.headless:
+        backends = headless_backends(parse_input_script(args.input), frames=args.frames)
+    elif args.frames is not None or args.input != "":
+        parser.error("--frames and --input need --headless")
+    else:
+        backends = pygame_backends()
+
+    if args.full_redraw:
+        if args.show_damage:
+            parser.error("--show-damage doesn't work with --full-redraw")
+        renderer = None
+    else:
+        renderer = DamageRenderer(show_damage=args.show_damage)
+
+    emu = N32Emu(args.game, image_cache=image_cache, cache_budgets=cache_budgets, prefetch_workers=args.prefetch, use_mmap=args.mmap,
+                 backends=backends, renderer=renderer, layer_budget=int(args.layer_budget * 1024 * 1024),
+                 convert_surfaces=not args.raw_surfaces, movie_atlases=args.movie_atlases, compact_images=args.compact_images)
+    start = time.perf_counter()
+    try:
+        ticks = emu.run()
+    finally:
+        TRACE.close()
+    elapsed = time.perf_counter() - start
+    if args.headless:
+        print(f"{ticks} ticks in {elapsed:.2f}s, {ticks / elapsed:.1f} ticks/s, {emu.culled / max(ticks, 1):.1f} off-screen entries culled per tick")
+    if args.cache_stats:
+        emu.print_cache_stats()
 
 if __name__ == '__main__':
     main()
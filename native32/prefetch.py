@@ -0,0 +1,144 @@
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from actions import Action
+from asset_cache import MISSING
+from process_file import ObjectType
+from tracing import TRACE, WARNING
+
+__all__ = ["AssetPrefetcher"]
+
+class AssetPrefetcher:
+    def __init__(self, reader, workers=1):
+        self.r = reader
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="n32prefetch")
+        self._lock = threading.Lock()
+        self._pending = {} # (kind, index) -> Future
+        self._unused = set() # prefetched but not yet asked for
+        self.prefetched = 0
+        self.used = 0
+        self.failed = 0
+        reader.prefetcher = self
+
+    def _script_gotos(self, index):
+        # Static GotoFrame payloads reachable from an action entry point, explored the same way decompile() does
+        targets = set()
+        to_explore = [index]
+        explored = set()
+        while len(to_explore) > 0:
+            i = to_explore.pop()
+            target = ""
+            while i not in explored:
+                explored.add(i)
+                action = self.r.get_action(i)
+                if action is None:
+                    break
+                op, payload = action
+                if op == Action.End:
+                    break
+                elif op == Action.SetTarget:
+                    target = payload
+                elif op == Action.GotoFrame and target == "" and isinstance(payload, int):
+                    # a GotoFrame without a payload is only an error if it runs
+                    targets.add(payload + 1)
+                elif op in (Action.If, Action.Jump) and payload is not None:
+                    dst = i + payload + 1 if payload >= 0 else i + payload
+                    if dst not in explored:
+                        to_explore.append(dst)
+                    if op == Action.Jump:
+                        break
+                i += 1
+        return targets
+
+    def predict(self, frame):
+        # Frames that can follow `frame`: the next one and any static GotoFrame from its scripts
+        next_frames = {frame + 1}
+        objects = self.r.get_frame(frame) if frame >= 1 else None
+        if objects is not None:
+            for obj in objects:
+                if obj.obj_type == ObjectType.Action:
+                    next_frames |= self._script_gotos(obj.index)
+        images = []
+        sounds = []
+        for i in sorted(next_frames):
+            objects = self.r.get_frame(i)
+            if objects is None:
+                continue
+            for obj in objects:
+                if obj.obj_type == ObjectType.Image:
+                    images.append(obj.index)
+                elif obj.obj_type == ObjectType.Movie:
+                    for fr in self.r.get_movie(obj.index):
+                        images.append(fr.image)
+                        if fr.sound != 0:
+                            sounds.append(fr.sound & 0xFF)
+        return list(dict.fromkeys(images)), list(dict.fromkeys(sounds))
+
+    def schedule(self, frame):
+        images, sounds = self.predict(frame)
+        for kind, indices, shared, cache, load in (
+                ("image", images, self.r._shared_image, self.r._images_cache, self.r.prefetch_image),
+                ("sound", sounds, self.r._shared_sound, self.r._sound_cache, self.r.prefetch_sound)):
+            for index in indices:
+                # duplicates are cached under the index they share
+                index = shared(index)
+                key = (kind, index)
+                with self._lock:
+                    if key in self._pending or index in cache:
+                        continue
+                    self._pending[key] = self._pool.submit(self._run, key, load, index)
+
+    def _run(self, key, load, index):
+        try:
+            result = load(index)
+        except Exception as e:
+            # a bad prediction must not take the emulator down, the real access will report it
+            TRACE.emit("asset", WARNING, f"prefetch of {key[0]} {index} failed: {e}", kind=key[0], index=index, error=repr(e))
+            result = MISSING
+        with self._lock:
+            self._pending.pop(key, None)
+            if result is MISSING:
+                self.failed += 1
+            else:
+                self.prefetched += 1
+                self._unused.add(key)
+        return result
+
+    def wait(self, kind, index):
+        # The asset wasn't in the cache; if it is still being prefetched, wait for it rather than decoding it twice
+        key = (kind, index)
+        with self._lock:
+            future = self._pending.get(key)
+        if future is None:
+            return MISSING
+        try:
+            result = future.result()
+        except CancelledError:
+            return MISSING
+        if result is not MISSING:
+            self.note_use(kind, index)
+        return result
+
+    def note_use(self, kind, index):
+        key = (kind, index)
+        if key in self._unused:
+            with self._lock:
+                if key in self._unused:
+                    self._unused.discard(key)
+                    self.used += 1
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            # whatever is still pending was cancelled and will never finish
+            self._pending.clear()
+        if self.r.prefetcher is self:
+            self.r.prefetcher = None
+
+    def stats(self):
+        return {
+            "prefetched": self.prefetched,
+            "used": self.used,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }
@@ -1,11 +1,22 @@
 import sys, struct
 import re
+import io
+import os
+import argparse
+import contextlib
+import mmap
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from decrypt_header import decrypt_header
-from decode_image import decode_image_argb, decode_image_yuv
+from decode_image import ARGB1555Image, decode_image_argb, decode_image_argb1555, decode_image_yuv
+from image_cache import hash_game_data
+from asset_cache import MISSING, LRUCache, AssetDedup, image_nbytes, sound_nbytes, table_nbytes
 from actions import Action
+from actionvm import Program
 from decompile import decompile
+from tracing import TRACE, DEBUG
 
 from dataclasses import dataclass
 
@@ -13,6 +24,11 @@ from enum import IntEnum, Enum
 
 __all__ = ["ObjectType", "FrameObject", "MovieFrame", "AudioFormat", "Native32Reader"]
 
+_ACTIONS = {act.value: act for act in Action}
+
+# default for the surfaces expanded from compact images, about what a few scenes draw
+EXPANDED_BUDGET = 8 * 1024 * 1024
+
 class ObjectType(IntEnum):
     Image = 1
     Movie = 2
@@ -43,16 +59,40 @@ class AudioFormat(Enum):
     RAW = "raw"
 
 class Native32Reader:
-    def __init__(self, f):
-        self.data = f.read()
+    def __init__(self, f, image_cache=None, cache_budgets=None, use_mmap=False, compact_images=False, strict_images=False):
+        self.path = getattr(f, "name", None)
+        if use_mmap:
+            # Only the pages that are actually touched get read, and they are shared with other processes
+            # mapping the same file. The mapping outlives f being closed.
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self._mmap)
+        else:
+            self._mmap = None
+            self.data = memoryview(f.read())
+        # self.data is a memoryview either way, so slicing it never copies
+        self.image_cache = image_cache
+        self.image_converter = None
+        # ARGB images are cached as their 16-bit pixels and only expanded to surfaces while they are being drawn
+        self.compact_images = compact_images
+        # fail on ARGB images with unknown ops instead of leaving the rest of them transparent
+        self.strict_images = strict_images
+        self.prefetcher = None
+        self.index = None
+        self._content_hash = None
         self.idx = 0
         self.resolution = (320, 240)
-        self._actions_cache = [None]
-        self._images_cache = {}
-        self._frames_cache = {}
-        self._movies_cache = {}
-        self._sound_cache = {}
-        self._button_events_cache = {}
+        self._actions_cache = None
+        self._program = None
+        # budgets are in bytes per category, missing or None means unbounded
+        budgets = cache_budgets or {}
+        self._images_cache = LRUCache(budgets.get("images"), image_nbytes)
+        self._image_sizes = {}
+        self.dedup = AssetDedup()
+        self._expanded_cache = LRUCache(budgets.get("expanded", EXPANDED_BUDGET), image_nbytes)
+        self._frames_cache = LRUCache(budgets.get("frames"), table_nbytes)
+        self._movies_cache = LRUCache(budgets.get("movies"), table_nbytes)
+        self._sound_cache = LRUCache(budgets.get("sounds"), sound_nbytes)
+        self._button_events_cache = LRUCache(budgets.get("buttons"), table_nbytes)
 
     def skip_thumbnail(self):
         if self.data[self.idx:self.idx+4] == b'SWFT':
@@ -69,7 +109,7 @@ class Native32Reader:
         while self.idx < len(self.data) - 4:
             magic = self.data[self.idx:self.idx+4]
             if magic in (b'_YUV', b'ARGB'):
-                self.colorspace = magic.decode('utf-8')
+                self.colorspace = bytes(magic).decode('utf-8')
                 print(f"Found {self.colorspace} Native32 header at 0x{self.idx:x}")
                 return
             self.idx += 1
@@ -121,49 +161,89 @@ class Native32Reader:
         self.sound_table = self.idx
 
     def _get_str(self, offset):
-        s = ''
-        while offset < len(self.data):
-            if self.data[offset] == 0x0:
-                break
-            s += chr(self.data[offset])
-            offset += 1
-        return s
-
-    def _disassemble_action(self, index):
-        ptr = self.base + self.action_idx + (index - 1) * 8
-        if ptr > len(self.data) - 8:
-            return None
-        opcode, payload = struct.unpack("<LL", self.data[ptr:ptr+8])
-        try:
-            act = Action(opcode)
-        except ValueError:
-            return None
+        if offset >= len(self.data):
+            return ''
+        end = self.data.obj.find(b'\0', offset)
+        if end == -1:
+            end = len(self.data)
+        return bytes(self.data[offset:end]).decode('latin-1')
+
+    def _action_payload(self, act, payload):
         if payload == 0x0 or act == Action.End:
             payload = None
         else:
             payload_idx = self.base + payload
             if payload_idx < len(self.data):
                 if act in (Action.If, Action.GotoFrame, Action.GotoFrame2, Action.Jump):
-                    payload, = struct.unpack("<h", self.data[payload_idx:payload_idx+2])
+                    payload, = struct.unpack_from("<h", self.data, payload_idx)
                 else:
                     payload = self._get_str(payload_idx)
-        return (act, payload)
+        return payload
+
+    def _disassemble_action(self, index):
+        ptr = self.base + self.action_idx + (index - 1) * 8
+        if ptr > len(self.data) - 8:
+            return None
+        opcode, payload = struct.unpack("<LL", self.data[ptr:ptr+8])
+        act = _ACTIONS.get(opcode)
+        if act is None:
+            return None
+        return (act, self._action_payload(act, payload))
+
+    def _action_table_end(self):
+        # The table runs up to whichever table, frame/movie/button record, image or MP3 data follows it, or the end
+        # of the file. Each pointer table is read up to its terminator or the next table.
+        tables = sorted(self.base + t for t in (self.frame_idx, self.image_idx, self.movie_idx, self.button_idx, self.button_cond_idx))
+        offsets = [self.frame_idx, self.image_idx, self.movie_idx, self.button_idx, self.button_cond_idx, self.mp3_offset]
+        for i, start in enumerate(tables):
+            stop = tables[i + 1] if i + 1 < len(tables) else len(self.data)
+            for ptr, in struct.iter_unpack("<L", self.data[start:start + (stop - start) // 4 * 4]):
+                if ptr == 0x0 or ptr == 0xFFFFFFFF or self.base + ptr >= len(self.data):
+                    break
+                offsets.append(ptr)
+        end = len(self.data)
+        for offset in offsets:
+            if offset > self.action_idx:
+                end = min(end, self.base + offset)
+        return end
+
+    def _decode_action_table(self):
+        # The whole table in one pass (1-based, so index 0 is None). Entries that aren't actions are None and only
+        # fail when a script reaches them, scripts stored after them still run.
+        actions = [None]
+        start = self.base + self.action_idx
+        count = max(0, (self._action_table_end() - start) // 8)
+        for opcode, payload in struct.iter_unpack("<LL", self.data[start:start+count*8]):
+            act = _ACTIONS.get(opcode)
+            if act is None:
+                actions.append(None)
+                continue
+            actions.append((act, self._action_payload(act, payload)))
+        return actions
 
     def get_action(self, index):
-        while index >= len(self._actions_cache):
-            i = len(self._actions_cache)
-            self._actions_cache.append(self._disassemble_action(i))
-        return self._actions_cache[index]
+        if self._actions_cache is None:
+            self._actions_cache = self._decode_action_table()
+        if index < len(self._actions_cache):
+            return self._actions_cache[index]
+        return self._disassemble_action(index)
+
+    def get_program(self):
+        if self._program is None:
+            if self._actions_cache is None:
+                self._actions_cache = self._decode_action_table()
+            self._program = Program(self._actions_cache)
+        return self._program
 
     def disassemble_actions(self):
+        if self._actions_cache is None:
+            self._actions_cache = self._decode_action_table()
+        # up to the first entry that isn't an action
         self.actions = []
-        i = 1
-        while True:
-            action = self._disassemble_action(i)
+        for action in self._actions_cache[1:]:
             if action is None:
                 break
             self.actions.append(action)
-            i += 1
 
     def save_actions(self, out_dir):
         with open(f"{out_dir}/actions.txt", "w") as f:
@@ -176,44 +256,165 @@ class Native32Reader:
                     fmt_payload = f' {payload}'
                 print(f"{act.name:16}{fmt_payload}", file=f)
 
-    def get_image(self, index, yuv_dump=None):
-        if index not in self._images_cache:
-            ptr = self.base + self.image_idx + 4 * (index - 1)
-            img_offset, = struct.unpack("<L", self.data[ptr:ptr+4])
-            if img_offset == 0xFFFFFFFF:
-                self._images_cache[index] = None
-            img_width, img_height, img_size = struct.unpack("<HHL", self.data[self.base+img_offset:self.base+img_offset+8])
-            if self.colorspace == "ARGB":
-                self._images_cache[index] = decode_image_argb(self.data[self.base+img_offset:self.base+img_offset+img_size+8])
-            else:
-                self._images_cache[index] = decode_image_yuv(self.data[self.base+img_offset:self.base+img_offset+img_size+8], yuv_dump=yuv_dump)
-        return self._images_cache[index]
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = hash_game_data(self.data)
+        return self._content_hash
 
-    def extract_images(self, out_dir):
-        from pygame import image
+    def image_count(self):
         i = self.base + self.image_idx
-        Path(f"{out_dir}/images").mkdir(exist_ok=True)
-        index = 1
+        count = 0
         while i < len(self.data) - 4 and i != (self.base + self.movie_idx):
             img_offset, = struct.unpack("<L", self.data[i:i+4])
             if img_offset == 0xFFFFFFFF:
                 break
+            count += 1
+            i += 4
+        return count
 
+    def _image_offset(self, index):
+        ptr = self.base + self.image_idx + 4 * (index - 1)
+        img_offset, = struct.unpack("<L", self.data[ptr:ptr+4])
+        if img_offset == 0xFFFFFFFF:
+            return None
+        return self.base + img_offset
+
+    def _image_data(self, index):
+        img_offset = self._image_offset(index)
+        if img_offset is None:
+            return None
+        img_width, img_height, img_size = struct.unpack("<HHL", self.data[img_offset:img_offset+8])
+        return self.data[img_offset:img_offset+img_size+8] # +8 to include header
+
+    def _image_location(self, index):
+        img_offset = self._image_offset(index)
+        if img_offset is None:
+            return None
+        return (img_offset, self._image_data(index))
+
+    def _shared_image(self, index):
+        return self.dedup.shared("image", index, self._image_location)
+
+    def get_image_size(self, index):
+        # (width, height) from the image header, without decoding it
+        size = self._image_sizes.get(index)
+        if size is None:
+            img_offset = self._image_offset(index)
+            if img_offset is None:
+                return None
+            size = self._image_sizes[index] = struct.unpack("<HH", self.data[img_offset:img_offset+4])
+        return size
+
+    def _decode_image(self, index, yuv_dump=None):
+        data = self._image_data(index)
+        if data is None:
+            return None
+        if self.colorspace == "ARGB":
+            if self.compact_images:
+                return decode_image_argb1555(data, strict=self.strict_images)
+            return decode_image_argb(data, strict=self.strict_images)
+        else:
+            return decode_image_yuv(data, yuv_dump=yuv_dump)
+
+    def _timed_decode(self, index, yuv_dump=None):
+        # only actual decodes count towards the decoding time the dedup stats report as saved
+        start = time.perf_counter()
+        img = self._decode_image(index, yuv_dump=yuv_dump)
+        self.dedup.load_times[("image", index)] = time.perf_counter() - start
+        return img
+
+    def _load_image(self, index, yuv_dump=None):
+        if self.compact_images and self.colorspace == "ARGB":
+            # cheap enough to decode that the disk cache wouldn't pay for itself
+            return self._timed_decode(index)
+        img = None
+        # a YUV dump needs the planes from a real decode
+        use_disk_cache = self.image_cache is not None and yuv_dump is None
+        if use_disk_cache:
+            img = self.image_cache.get(self.content_hash(), index)
+            if img is not None and TRACE.asset:
+                TRACE.emit("asset", DEBUG, f"image {index} from the disk cache", image=index)
+        if img is None:
+            img = self._timed_decode(index, yuv_dump=yuv_dump)
+            if TRACE.asset:
+                TRACE.emit("asset", DEBUG, f"decoded image {index}", image=index)
+            if use_disk_cache and img is not None:
+                self.image_cache.put(self.content_hash(), index, img)
+        if self.image_converter is not None:
+            img = self.image_converter(img)
+        return img
+
+    def set_image_converter(self, converter):
+        # converter(img) is applied to every image before it is cached, e.g. to match the screen's pixel format,
+        # including the ones already cached
+        self.image_converter = converter
+        for index, img in self._images_cache.items():
+            if not isinstance(img, ARGB1555Image):
+                self._images_cache[index] = converter(img)
+        self._expanded_cache.clear()
+
+    def _expand_image(self, index, img):
+        surface = self._expanded_cache.get(index)
+        if surface is MISSING:
+            surface = img.expand()
+            if self.image_converter is not None:
+                surface = self.image_converter(surface)
+            self._expanded_cache[index] = surface
+        return surface
+
+    def get_image(self, index, yuv_dump=None):
+        # a YUV dump has to come from decoding this very index
+        shared = self._shared_image(index) if yuv_dump is None else index
+        img = self._images_cache.get(shared)
+        if img is MISSING:
+            if self.prefetcher is not None:
+                img = self.prefetcher.wait("image", shared)
+            if img is MISSING:
+                img = self._load_image(shared, yuv_dump=yuv_dump)
+                self._images_cache[shared] = img
+        elif self.prefetcher is not None:
+            self.prefetcher.note_use("image", shared)
+        if shared != index:
+            self.dedup.served("image", index, shared, image_nbytes(img))
+        if isinstance(img, ARGB1555Image):
+            img = self._expand_image(shared, img)
+        return img
+
+    def prefetch_image(self, index):
+        # runs on the prefetcher's worker thread, index is already the shared one
+        img = self._load_image(index)
+        self._images_cache[index] = img
+        return img
+
+    def extract_images(self, out_dir, start=1, end=None):
+        from pygame import image
+        Path(f"{out_dir}/images").mkdir(exist_ok=True)
+        if end is None:
+            end = self.image_count() + 1
+        for index in range(start, end):
             # Also save raw binary for debug
-            img_width, img_height, img_size = struct.unpack("<HHL", self.data[self.base+img_offset:self.base+img_offset+8])
             with open(f"{out_dir}/images/{index}.bin", "wb") as f:
-                f.write(self.data[self.base+img_offset:self.base+img_offset+img_size+8]) # +8 to include header
+                f.write(self._image_data(index))
             if self.colorspace == "ARGB":
                 img = self.get_image(index)
             else:
                 with open(f"{out_dir}/images/{index}.yuv", "wb") as f:
                     img = self.get_image(index, yuv_dump=f)
             image.save(img, f"{out_dir}/images/{index}.png")
-            index += 1
-            i += 4
+
+    def build_index(self):
+        from table_index import TableIndex
+        self.index = TableIndex(self)
+        return self.index
 
     def get_frame(self, frame):
-        if frame not in self._frames_cache:
+        objects = self._frames_cache.get(frame)
+        if objects is MISSING and self.index is not None:
+            indexed = self.index.frame(frame)
+            if indexed is not None:
+                # built once per cache fill, callers iterate it over and over
+                objects = self._frames_cache[frame] = list(indexed)
+        if objects is MISSING:
             objects = []
             ptr_idx = self.base + self.frame_idx + 4 * (frame - 1)
             offset, = struct.unpack("<L", self.data[ptr_idx:ptr_idx+4])
@@ -233,7 +434,7 @@ class Native32Reader:
                 objects.append(FrameObject(obj_type, index, x, y, depth, name))
                 i += 0x10
             self._frames_cache[frame] = objects
-        return self._frames_cache[frame]
+        return objects
 
     def extract_frames(self, out_dir):
         i = 1
@@ -261,7 +462,10 @@ class Native32Reader:
                         decompile(f, self.actions, fr.action, f"movie{i}_act{fr.action}")
 
     def get_movie(self, movie):
-        if movie not in self._movies_cache:
+        frames = self._movies_cache.get(movie)
+        if frames is MISSING and self.index is not None:
+            frames = self._movies_cache[movie] = self.index.movie(movie)
+        if frames is MISSING:
             idx_ptr = self.base + self.movie_idx + (4 * (movie - 1))
             ptr, = struct.unpack("<L", self.data[idx_ptr:idx_ptr+4])
             ptr += self.base
@@ -273,7 +477,7 @@ class Native32Reader:
                 frames.append(MovieFrame(*obj))
                 ptr += 0xC
             self._movies_cache[movie] = frames
-        return self._movies_cache[movie]
+        return frames
 
     def extract_movies(self, out_dir):
         movie_indices = set()
@@ -292,29 +496,68 @@ class Native32Reader:
     def _endian_swap_resample(self, data):
         return bytes(data[(2 * (i // 4)) | ((i & 0x1) ^ 0x1)] for i in range(2 * (len(data) & 0xFFFFFFFE)))
 
+    def _sound_data(self, idx):
+        # (table pointer, format, encoded bytes)
+        table_idx = self.sound_table + (idx - 1) * 4
+        ptr, = struct.unpack("<L", self.data[table_idx:table_idx+4])
+        flags = ptr & 0xF0000000
+        addr = ptr & 0x0FFFFFFF
+        if flags == 0xF0000000: # MP3 audio
+            # MP3 format
+            begin = self.base + self.mp3_offset + addr
+            size, unk = struct.unpack("<LH", self.data[begin:begin+6])
+            begin += 6
+            return ptr, AudioFormat.MP3, self.data[begin:begin+size]
+        elif flags == 0x00000000: # raw samples
+            # 11025Hz?, 16-bit, big endian, mono?
+            begin = self.base + addr
+            size, = struct.unpack("<L", self.data[begin:begin+4])
+            begin += 4
+            return ptr, AudioFormat.RAW, self.data[begin:begin+size]
+        else:
+            raise KeyError(idx)
+
+    def _shared_sound(self, idx):
+        def locate(idx):
+            ptr, form, data = self._sound_data(idx)
+            return (ptr, data)
+        try:
+            return self.dedup.shared("sound", idx, locate)
+        except KeyError:
+            # loading it reports the bad entry
+            return idx
+
+    def _load_sound(self, idx):
+        ptr, form, data = self._sound_data(idx)
+        if form == AudioFormat.RAW and self.colorspace != "ARGB":
+            start = time.perf_counter()
+            data = self._endian_swap_resample(data)
+            self.dedup.load_times[("sound", idx)] = time.perf_counter() - start
+        sound = (form, data)
+        if TRACE.asset:
+            TRACE.emit("asset", DEBUG, f"loaded {sound[0].value} sound {idx}", sound=idx, bytes=len(sound[1]))
+        return sound
+
     def get_sound(self, idx):
-        if idx not in self._sound_cache:
-            table_idx = self.sound_table + (idx - 1) * 4
-            ptr, = struct.unpack("<L", self.data[table_idx:table_idx+4])
-            flags = ptr & 0xF0000000
-            addr = ptr & 0x0FFFFFFF
-            if flags == 0xF0000000: # MP3 audio
-                # MP3 format
-                begin = self.base + self.mp3_offset + addr
-                size, unk = struct.unpack("<LH", self.data[begin:begin+6])
-                begin += 6
-                self._sound_cache[idx] = (AudioFormat.MP3, bytes(self.data[begin:begin+size]))
-                
-            elif flags == 0x00000000: # raw samples
-                # 11025Hz?, 16-bit, big endian, mono?
-                begin = self.base + addr
-                size, = struct.unpack("<L", self.data[begin:begin+4])
-                begin += 4
-                if self.colorspace == "ARGB":
-                    self._sound_cache[idx] = (AudioFormat.RAW, self.data[begin:begin+size])
-                else:
-                    self._sound_cache[idx] = (AudioFormat.RAW, self._endian_swap_resample(self.data[begin:begin+size]))
-        return self._sound_cache[idx]
+        shared = self._shared_sound(idx)
+        sound = self._sound_cache.get(shared)
+        if sound is MISSING:
+            if self.prefetcher is not None:
+                sound = self.prefetcher.wait("sound", shared)
+            if sound is MISSING:
+                sound = self._load_sound(shared)
+                self._sound_cache[shared] = sound
+        elif self.prefetcher is not None:
+            self.prefetcher.note_use("sound", shared)
+        if shared != idx:
+            self.dedup.served("sound", idx, shared, sound_nbytes(sound))
+        return sound
+
+    def prefetch_sound(self, idx):
+        # runs on the prefetcher's worker thread, idx is already the shared one
+        sound = self._load_sound(idx)
+        self._sound_cache[idx] = sound
+        return sound
 
     def _save_sound(self, sound, idx, out_dir):
         form, audio_data = sound
@@ -358,7 +601,12 @@ class Native32Reader:
         print("", file=f)
 
     def get_button_events(self, button):
-        if button not in self._button_events_cache:
+        if self.index is not None:
+            events = self.index.button_events(button)
+            if events is not None:
+                return events
+        events = self._button_events_cache.get(button)
+        if events is MISSING:
             cond_table_idx = self.base + self.button_cond_idx + (button - 1) * 4
             ptr, = struct.unpack("<L", self.data[cond_table_idx:cond_table_idx+4])
             ptr += self.base
@@ -372,7 +620,7 @@ class Native32Reader:
                 i += act_len
                 ptr += 0x6
             self._button_events_cache[button] = events
-        return self._button_events_cache[button]
+        return events
 
     def extract_buttons(self, out_dir):
         button_indices = set()
@@ -384,16 +632,50 @@ class Native32Reader:
             for button in button_indices:
                 self.decompile_button(button, f)
 
+    def image_memory(self):
+        # bytes taken by the cached images, and what they would take as RGBA surfaces
+        images = [img for img in self._images_cache.values() if img is not None]
+        return {
+            "images": len(images),
+            "bytes": sum(image_nbytes(img) for img in images),
+            "rgba_bytes": sum(img.get_size()[0] * img.get_size()[1] * 4 for img in images),
+        }
+
+    def cache_stats(self):
+        stats = {
+            "images": self._images_cache.stats(),
+            "frames": self._frames_cache.stats(),
+            "movies": self._movies_cache.stats(),
+            "sounds": self._sound_cache.stats(),
+            "buttons": self._button_events_cache.stats(),
+        }
+        if self.compact_images:
+            stats["expanded"] = self._expanded_cache.stats()
+        return stats
+
+    def load_tables(self):
+        # Parse all frames and the movies they use, without writing anything
+        i = 1
+        while self.get_frame(i) is not None:
+            i += 1
+        for frame in self._frames_cache.values():
+            for o in frame:
+                if o.obj_type == ObjectType.Movie:
+                    self.get_movie(o.index)
+
     def init(self):
         self.skip_thumbnail()
         self.find_header()
         self.process_header()
 
-    def run(self, out_dir):
+    def run(self, out_dir, jobs=1):
         Path(out_dir).mkdir(exist_ok=True)
         self.skip_thumbnail()
         self.find_header()
         self.process_header()
+        if jobs > 1 and self.path is not None:
+            self.run_parallel(out_dir, jobs)
+            return
         self.disassemble_actions()
         self.save_actions(out_dir)
         self.extract_frames(out_dir)
@@ -403,6 +685,59 @@ class Native32Reader:
         self.extract_images(out_dir)
         self.extract_sounds(out_dir)
 
+    def run_parallel(self, out_dir, jobs):
+        # Every output file is written by exactly one stage, so the result doesn't depend on the worker count
+        count = self.image_count()
+        chunk = max(1, -(-count // (jobs * 4)))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_extract_stage, self.path, out_dir, stage) for stage in ("actions", "frames", "sounds")]
+            for start in range(1, count + 1, chunk):
+                futures.append(pool.submit(_extract_stage, self.path, out_dir, "images", start, min(start + chunk, count + 1),
+                                           self.strict_images))
+            for future in futures:
+                stage, start, end = future.result()
+                if stage == "images":
+                    print(f"Extracted images {start}-{end - 1}")
+                else:
+                    print(f"Extracted {stage}")
+
+def _open_reader(path, strict_images=False):
+    with open(path, 'rb') as f:
+        r = Native32Reader(f, use_mmap=True, strict_images=strict_images)
+    # the header has already been reported by the parent process
+    with contextlib.redirect_stdout(io.StringIO()):
+        r.init()
+    return r
+
+def _extract_stage(path, out_dir, stage, start=1, end=None, strict_images=False):
+    r = _open_reader(path, strict_images)
+    if stage == "actions":
+        r.disassemble_actions()
+        r.save_actions(out_dir)
+        r.load_tables()
+        r.decompile_actions(out_dir)
+        r.extract_buttons(out_dir)
+    elif stage == "frames":
+        r.extract_frames(out_dir)
+        r.extract_movies(out_dir)
+    elif stage == "sounds":
+        r.load_tables()
+        r.extract_sounds(out_dir)
+    elif stage == "images":
+        r.extract_images(out_dir, start, end)
+    return stage, start, end
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the contents of a Native32 game")
+    parser.add_argument("game", help="game file (.smf/.sgm/.ssl)")
+    parser.add_argument("out_dir", help="output directory")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, default=1, help="worker processes, 0 for one per CPU (default: %(default)s)")
+    parser.add_argument("--mmap", action="store_true", help="memory-map the game file instead of reading it into memory")
+    parser.add_argument("--strict", action="store_true", help="stop at the first image that doesn't decode instead of extracting it partly transparent")
+    args = parser.parse_args()
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    with open(args.game, 'rb') as f:
+        Native32Reader(f, use_mmap=args.mmap, strict_images=args.strict).run(args.out_dir, jobs=jobs)
+
 if __name__ == '__main__':
-    with open(sys.argv[1], 'rb') as f:
-        Native32Reader(f).run(sys.argv[2])
+    main()
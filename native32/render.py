@@ -0,0 +1,282 @@
+import pygame
+
+from asset_cache import MISSING, LRUCache, image_nbytes
+
+__all__ = ["DamageRenderer", "StaticLayers", "DisplayFormat", "MovieAtlases", "Viewport", "blit_list"]
+
+# A frame is drawn from a blit list of (key, surface, rect, area), in depth order, area being the part of the
+# surface to blit (None for all of it). key says what is drawn where, so two entries with the same key look the same.
+
+class Viewport:
+    # Leaves out the entries entirely off the screen before their images are decoded or blitted, going by the size
+    # in the image header. culled counts them, the owner resets it for every blit list.
+    def __init__(self, resolution, get_size):
+        self.rect = pygame.Rect((0, 0), resolution)
+        self.get_size = get_size
+        self.culled = 0
+
+    def visible(self, d, offset):
+        size = self.get_size(d.image)
+        if size is None or self.rect.colliderect((offset[0] + d.x, offset[1] + d.y), size):
+            return True
+        self.culled += 1
+        return False
+
+def blit_list(drawlist, get_image, offset=(0, 0), atlases=None, get_movie=None, viewport=None):
+    blits = []
+    for d in drawlist:
+        if viewport is not None and not viewport.visible(d, offset):
+            continue
+        x, y = offset[0] + d.x, offset[1] + d.y
+        packed = None
+        if atlases is not None and d.movie != 0:
+            packed = atlases.lookup(d.movie, d.image, get_movie, get_image)
+        if packed is not None:
+            atlas, area = packed
+            blits.append(((d.image, x, y, d.depth), atlas, pygame.Rect((x, y), area.size), area))
+        else:
+            img = get_image(d.image)
+            blits.append(((d.image, x, y, d.depth), img, img.get_rect(topleft=(x, y)), None))
+    return blits
+
+# Colours tried as the colorkey of an image, the first one no opaque pixel uses is taken. ARGB1555 colours expand
+# to multiples of 8, so in ARGB games it is always the first.
+_COLORKEYS = ((255, 0, 255), (1, 254, 3), (254, 3, 1), (3, 1, 254))
+
+def _free_colorkey(pixels):
+    # pixels in RGBA, a match at an unaligned offset only makes us try the next colour
+    for key in _COLORKEYS:
+        if bytes((*key, 255)) not in pixels:
+            return key
+    return None
+
+class DisplayFormat:
+    # Converts decoded RGBA images to the pixel format of the screen once, instead of on every blit. The decoders
+    # only produce fully opaque and fully transparent pixels, so the alpha channel becomes an RLE accelerated
+    # colorkey and blits skip the per-pixel blending. Converting an already converted surface does nothing.
+    def __init__(self, screen):
+        self.screen = screen
+        self.converted = 0
+
+    def __call__(self, img):
+        if img is None or not img.get_flags() & pygame.SRCALPHA:
+            return img
+        pixels = pygame.image.tobytes(img, "RGBA")
+        if pixels[3::4].translate(None, b"\x00\xff"):
+            # real translucency, keep blending it
+            return img
+        key = _free_colorkey(pixels)
+        if key is None:
+            return img
+        out = pygame.Surface(img.get_size(), 0, self.screen)
+        out.fill(key)
+        out.blit(img, (0, 0))
+        out.set_colorkey(key, pygame.RLEACCEL)
+        self.converted += 1
+        return out
+
+class MovieAtlases:
+    # The small images of a movie packed into one shared surface and blitted by sub-rect, built the first time the
+    # movie is drawn. Only colorkeyed images with the usual key are packed, everything else is blitted on its own.
+    # Blits are done in software, so there are no texture switches to save and a sub-rect blit of an RLE surface
+    # costs a little more than blitting a small surface of its own, which is why N32Emu only uses these on request.
+    def __init__(self, budget=8 * 1024 * 1024, max_size=64, width=256):
+        self.max_size = max_size # images larger than this either way stay separate
+        self.width = width
+        self.cache = LRUCache(budget, lambda entry: image_nbytes(entry[0]) if entry is not None else 0)
+
+    def clear(self):
+        self.cache.clear()
+
+    def _build(self, movie_frames, get_image):
+        images = []
+        for index in sorted(set(movie_frames.image)):
+            img = get_image(index)
+            if img is not None and img.get_colorkey() is not None and img.get_colorkey()[:3] == _COLORKEYS[0] and \
+                    img.get_width() <= self.max_size and img.get_height() <= self.max_size:
+                images.append((index, img))
+        if len(images) < 2:
+            return None
+        # shelf packing, tallest first
+        images.sort(key=lambda entry: -entry[1].get_height())
+        areas = {}
+        x = y = shelf = 0
+        for index, img in images:
+            if x + img.get_width() > self.width:
+                x, y, shelf = 0, y + shelf, 0
+            areas[index] = img.get_rect(topleft=(x, y))
+            x += img.get_width()
+            shelf = max(shelf, img.get_height())
+        atlas = pygame.Surface((self.width, y + shelf), 0, images[0][1])
+        atlas.fill(_COLORKEYS[0])
+        for index, img in images:
+            atlas.blit(img, areas[index])
+        atlas.set_colorkey(_COLORKEYS[0], pygame.RLEACCEL)
+        return (atlas, areas)
+
+    def lookup(self, movie, image, get_movie, get_image):
+        # (atlas, area) for the image if it was packed, otherwise None
+        entry = self.cache.get(movie)
+        if entry is MISSING:
+            entry = self.cache[movie] = self._build(get_movie(movie), get_image)
+        if entry is None:
+            return None
+        atlas, areas = entry
+        area = areas.get(image)
+        if area is None:
+            return None
+        return (atlas, area)
+
+class StaticLayers:
+    # The images of a frame never move, so the runs of them drawn before the first movie and after the last one
+    # are composited once into a layer and blitted as one surface. The layer below the movies is opaque and
+    # screen-sized, since it starts from the black background, so it depends on the screen offset; the one above
+    # is transparent and only as big as its images. Layers are kept in a bounded LRU, keyed by frame.
+    def __init__(self, resolution, budget=8 * 1024 * 1024, min_images=2):
+        self.resolution = resolution
+        self.min_images = min_images
+        self.convert = None # a DisplayFormat once the screen is known
+        self.cache = LRUCache(budget, lambda entry: image_nbytes(entry[0]))
+
+    def clear(self):
+        # the frame numbers mean something else after loading another game
+        self.cache.clear()
+
+    def _below(self, frame_key, drawlist, get_image, offset, viewport):
+        key = ("below", frame_key, len(drawlist), offset)
+        entry = self.cache.get(key)
+        if entry is MISSING:
+            layer = pygame.Surface(self.resolution, 0, self.convert.screen) if self.convert is not None else pygame.Surface(self.resolution)
+            layer.fill("black")
+            culled = 0
+            for d in drawlist:
+                if viewport is None or viewport.visible(d, offset):
+                    layer.blit(get_image(d.image), (offset[0] + d.x, offset[1] + d.y))
+                else:
+                    culled += 1
+            entry = self.cache[key] = (layer, (0, 0), culled)
+        elif viewport is not None:
+            # the images left out of the layer are off the screen on every tick it is drawn
+            viewport.culled += entry[2]
+        return (key, entry[0], entry[0].get_rect(), None)
+
+    def _above(self, frame_key, drawlist, get_image, offset):
+        # the layer is reused at any offset, so it is culled by collapse() rather than here
+        key = ("above", frame_key, len(drawlist))
+        entry = self.cache.get(key)
+        if entry is MISSING:
+            images = [get_image(d.image) for d in drawlist]
+            rects = [img.get_rect(topleft=(d.x, d.y)) for d, img in zip(drawlist, images)]
+            bounds = rects[0].unionall(rects[1:])
+            layer = pygame.Surface(bounds.size, pygame.SRCALPHA)
+            for img, rect in zip(images, rects):
+                layer.blit(img, rect.move(-bounds.x, -bounds.y))
+            if self.convert is not None:
+                layer = self.convert(layer)
+            entry = self.cache[key] = (layer, bounds.topleft)
+        layer, topleft = entry
+        return (key + (offset,), layer, layer.get_rect(topleft=(topleft[0] + offset[0], topleft[1] + offset[1])), None)
+
+    def collapse(self, drawlist, get_image, offset, frame_key, atlases=None, get_movie=None, viewport=None):
+        # blit list for drawlist with the frame's leading and trailing images replaced by their layers
+        first = 0
+        while first < len(drawlist) and drawlist[first].key[1] == 0:
+            first += 1
+        last = len(drawlist)
+        while last > first and drawlist[last - 1].key[1] == 0:
+            last -= 1
+        blits = []
+        if first >= self.min_images:
+            blits.append(self._below(frame_key, drawlist[:first], get_image, offset, viewport))
+        else:
+            blits += blit_list(drawlist[:first], get_image, offset, viewport=viewport)
+        blits += blit_list(drawlist[first:last], get_image, offset, atlases, get_movie, viewport)
+        if len(drawlist) - last >= self.min_images:
+            # the layer is drawn if any of its images is on the screen, and the others are counted as culled
+            # exactly as blit_list() would count them, whether or not the layer is cached
+            if viewport is None or len([d for d in drawlist[last:] if viewport.visible(d, offset)]) > 0:
+                blits.append(self._above(frame_key, drawlist[last:], get_image, offset))
+        else:
+            blits += blit_list(drawlist[last:], get_image, offset, viewport=viewport)
+        return blits
+
+# Repaints only what changed since the last frame. Every blit is compared by image, position and depth with
+# the previous frame, and the areas of the entries that appeared, disappeared or moved are cleared and redrawn from
+# everything overlapping them, in depth order. A scroll or a change in the stacking order of entries that stayed
+# repaints the whole screen.
+
+class DamageRenderer:
+    def __init__(self, show_damage=False, max_rects=32):
+        self.show_damage = show_damage
+        self.max_rects = max_rects # past this many rects, repaint their bounding box instead
+        self.frames = 0
+        self.full_repaints = 0
+        self.repainted = 0 # pixels
+        self.invalidate()
+
+    def invalidate(self):
+        # the next frame is painted from scratch, e.g. after loading a new game
+        self._prev = None
+        self._prev_offset = None
+        self._overlay = []
+
+    def _keys(self, blits):
+        # blit keys plus a count that tells apart identical entries
+        seen = {}
+        keys = []
+        for key, img, rect, area in blits:
+            n = seen.get(key, 0)
+            seen[key] = n + 1
+            keys.append(key + (n,))
+        return keys
+
+    def _damage(self, prev, keys, rects, screen_rect):
+        # None if everything has to be repainted
+        prev_keys = set(prev)
+        new_keys = set(keys)
+        if [k for k in prev if k in new_keys] != [k for k in keys if k in prev_keys]:
+            return None
+        damage = [prev[k] for k in prev if k not in new_keys]
+        damage += [rect for k, rect in zip(keys, rects) if k not in prev_keys]
+        damage += self._overlay
+        damage = [rect.clip(screen_rect) for rect in damage]
+        damage = [rect for rect in damage if rect.width > 0 and rect.height > 0]
+        if len(damage) > self.max_rects:
+            damage = [damage[0].unionall(damage[1:])]
+        return damage
+
+    def render(self, screen, blits, offset=(0, 0)):
+        # blits is a blit list in depth order, returns the rects of the screen that changed
+        rects = [rect for key, img, rect, area in blits]
+        keys = self._keys(blits)
+        screen_rect = screen.get_rect()
+
+        damage = None
+        if self._prev is not None and offset == self._prev_offset:
+            damage = self._damage(self._prev, keys, rects, screen_rect)
+        if damage is None:
+            self.full_repaints += 1
+            damage = [screen_rect]
+            screen.fill("black")
+            screen.blits([(img, rect, area) for key, img, rect, area in blits], doreturn=False)
+        else:
+            for area in damage:
+                screen.set_clip(area)
+                screen.fill("black")
+                for key, img, rect, part in blits:
+                    if rect.colliderect(area):
+                        screen.blit(img, rect, part)
+            screen.set_clip(None)
+
+        self._overlay = []
+        if self.show_damage:
+            for area in damage:
+                pygame.draw.rect(screen, "red", area, 1)
+            # the outlines are painted over next frame
+            self._overlay = list(damage)
+
+        self._prev = dict(zip(keys, rects))
+        self._prev_offset = offset
+        self.frames += 1
+        self.repainted += sum(area.width * area.height for area in damage)
+        return damage
@@ -0,0 +1,238 @@
+import struct
+import sys
+from array import array
+
+from process_file import ObjectType, FrameObject, MovieFrame
+
+__all__ = ["TableIndex", "FrameObjects", "MovieFrames"]
+
+# Frames, movies and button events parsed in one pass into flat array columns. A frame or movie is then just
+# a (start, end) span into those columns, and every name string is stored once in a shared pool.
+
+_FRAME_OBJECT = struct.Struct("<HHhhHHL")
+_MOVIE_FRAME = struct.Struct("<HhhHHh")
+_BUTTON_EVENT = struct.Struct("<HHH")
+
+def _records(data, ptr, st):
+    # unpack fixed size records from ptr onwards, stopping where the per-record readers did (ptr < len - size)
+    count = -(-(len(data) - st.size - ptr) // st.size)
+    if count <= 0:
+        return iter(())
+    return st.iter_unpack(data[ptr:ptr + count * st.size])
+
+class FrameObjects:
+    __slots__ = ("_index", "start", "end")
+
+    def __init__(self, index, start, end):
+        self._index = index
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._index._frame_object(self.start + i)
+
+    def __iter__(self):
+        for i in range(self.start, self.end):
+            yield self._index._frame_object(i)
+
+    @property
+    def obj_type(self):
+        return self._index.obj_type[self.start:self.end]
+
+    @property
+    def index(self):
+        return self._index.obj_index[self.start:self.end]
+
+    @property
+    def x(self):
+        return self._index.obj_x[self.start:self.end]
+
+    @property
+    def y(self):
+        return self._index.obj_y[self.start:self.end]
+
+    @property
+    def depth(self):
+        return self._index.obj_depth[self.start:self.end]
+
+class MovieFrames:
+    __slots__ = ("_columns", "start", "end")
+
+    def __init__(self, columns, start, end):
+        self._columns = columns # image, x, y, action, sound, u3
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        i += self.start
+        return MovieFrame(*(c[i] for c in self._columns))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def image(self):
+        return self._columns[0][self.start:self.end]
+
+    @property
+    def x(self):
+        return self._columns[1][self.start:self.end]
+
+    @property
+    def y(self):
+        return self._columns[2][self.start:self.end]
+
+    @property
+    def action(self):
+        return self._columns[3][self.start:self.end]
+
+    @property
+    def sound(self):
+        return self._columns[4][self.start:self.end]
+
+    @property
+    def u3(self):
+        return self._columns[5][self.start:self.end]
+
+class TableIndex:
+    def __init__(self, reader):
+        self.r = reader
+        self.names = [] # string pool, obj_name holds indices into it (-1 for no name)
+        self._name_ids = {}
+        self._frame_spans = array("L", [0]) # frame i covers [_frame_spans[i-1], _frame_spans[i])
+        self._movie_spans = {}
+        self._unindexed = set() # frames that didn't parse, left to Native32Reader.get_frame to fail on if they're loaded
+        self._button_spans = {}
+        self.build()
+
+    def _intern(self, offset):
+        name_id = self._name_ids.get(offset)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(sys.intern(self.r._get_str(self.r.base + offset)))
+            self._name_ids[offset] = name_id
+        return name_id
+
+    def build(self):
+        r = self.r
+        data = r.data
+        obj_type, obj_index, obj_x, obj_y, obj_depth, obj_name = (array(t) for t in "HHhhHl")
+        frame = 1
+        while True:
+            ptr_idx = r.base + r.frame_idx + 4 * (frame - 1)
+            if ptr_idx + 4 > len(data):
+                break
+            offset, = struct.unpack_from("<L", data, ptr_idx)
+            if offset == 0x0 or offset > len(data):
+                break
+            start = len(obj_type)
+            try:
+                for t, index, x, y, depth, resv, name in _records(data, r.base + offset, _FRAME_OBJECT):
+                    if t == 0x0000 or t == 0xFFFF:
+                        break
+                    ObjectType(t)
+                    assert resv == 0, (frame, t, index, x, y, depth, resv, name)
+                    obj_type.append(t)
+                    obj_index.append(index)
+                    obj_x.append(x)
+                    obj_y.append(y)
+                    obj_depth.append(depth)
+                    obj_name.append(self._intern(name) if name != 0x0000 else -1)
+            except (ValueError, AssertionError):
+                for column in (obj_type, obj_index, obj_x, obj_y, obj_depth, obj_name):
+                    del column[start:]
+                self._unindexed.add(frame)
+            self._frame_spans.append(len(obj_type))
+            frame += 1
+
+        mov_columns = tuple(array(t) for t in "HhhHHh")
+        buttons = set()
+        for i, t in enumerate(obj_type):
+            if t == ObjectType.Movie and obj_index[i] not in self._movie_spans:
+                movie = obj_index[i]
+                start = len(mov_columns[0])
+                self._parse_movie(movie, mov_columns)
+                self._movie_spans[movie] = (start, len(mov_columns[0]))
+            elif t == ObjectType.Button:
+                buttons.add(obj_index[i])
+
+        btn_keycode, btn_event = array("H"), array("H")
+        for button in sorted(buttons):
+            cond_table_idx = r.base + r.button_cond_idx + (button - 1) * 4
+            ptr, = struct.unpack_from("<L", data, cond_table_idx)
+            ptr += r.base
+            total_act_len, = struct.unpack_from("<H", data, ptr)
+            start = len(btn_keycode)
+            i = 0
+            for keycode, act_len, event in _BUTTON_EVENT.iter_unpack(data[ptr + 2:ptr + 2 + 6 * total_act_len]):
+                if i >= total_act_len:
+                    break
+                btn_keycode.append(keycode)
+                btn_event.append(event)
+                i += act_len
+            self._button_spans[button] = (start, len(btn_keycode))
+
+        # the columns are never resized after this, so the views can hand out zero-copy slices
+        self.obj_type, self.obj_index, self.obj_x, self.obj_y, self.obj_depth, self.obj_name = (
+            memoryview(a) for a in (obj_type, obj_index, obj_x, obj_y, obj_depth, obj_name))
+        self.mov_columns = tuple(memoryview(a) for a in mov_columns)
+        self.btn_keycode, self.btn_event = memoryview(btn_keycode), memoryview(btn_event)
+
+    def _parse_movie(self, movie, columns):
+        r = self.r
+        idx_ptr = r.base + r.movie_idx + 4 * (movie - 1)
+        ptr, = struct.unpack_from("<L", r.data, idx_ptr)
+        for record in _records(r.data, r.base + ptr, _MOVIE_FRAME):
+            if record[0] == 0xFFFF or record[0] == 0x0000:
+                break
+            for column, value in zip(columns, record):
+                column.append(value)
+
+    def _frame_object(self, i):
+        name = self.obj_name[i]
+        return FrameObject(ObjectType(self.obj_type[i]), self.obj_index[i], self.obj_x[i], self.obj_y[i],
+                           self.obj_depth[i], self.names[name] if name >= 0 else None)
+
+    def frame_count(self):
+        return len(self._frame_spans) - 1
+
+    def frame(self, frame):
+        # None if the frame wasn't indexed
+        if not 1 <= frame < len(self._frame_spans) or frame in self._unindexed:
+            return None
+        return FrameObjects(self, self._frame_spans[frame - 1], self._frame_spans[frame])
+
+    def movie(self, movie):
+        span = self._movie_spans.get(movie)
+        if span is not None:
+            return MovieFrames(self.mov_columns, *span)
+        # only reached at runtime, parsed into its own columns (the reader's movie cache keeps it)
+        columns = tuple(array(t) for t in "HhhHHh")
+        self._parse_movie(movie, columns)
+        return MovieFrames(tuple(memoryview(a) for a in columns), 0, len(columns[0]))
+
+    def button_events(self, button):
+        span = self._button_spans.get(button)
+        if span is None:
+            return None
+        return list(zip(self.btn_keycode[span[0]:span[1]], self.btn_event[span[0]:span[1]]))
+
+    def nbytes(self):
+        columns = (self.obj_type, self.obj_index, self.obj_x, self.obj_y, self.obj_depth, self.obj_name,
+                   *self.mov_columns, self.btn_keycode, self.btn_event)
+        return sum(c.nbytes for c in columns) + self._frame_spans.itemsize * len(self._frame_spans)
@@ -0,0 +1,96 @@
+import collections
+import json
+import sys
+import time
+
+__all__ = ["TRACE", "Tracer", "CATEGORIES", "LEVELS", "DEBUG", "INFO", "WARNING", "ERROR"]
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+_LEVEL_NAMES = {v: k for k, v in LEVELS.items()}
+
+CATEGORIES = ("vm", "frame", "sound", "asset")
+
+class Tracer:
+    # Each category is a plain attribute that is False while it is disabled, so trace points are written as
+    #   if TRACE.vm: TRACE.emit("vm", DEBUG, f"...")
+    # and cost one attribute check when tracing is off, the message isn't even formatted. Warnings and errors are
+    # rare enough to emit unconditionally: they always land in the ring buffer, so a crash dump shows them even with
+    # tracing off, and go to the console or file when their category is enabled.
+    def __init__(self, buffer_size=1000):
+        self.ring = collections.deque(maxlen=buffer_size)
+        self.console = False
+        self.sink = None
+        self.tick = 0
+        self._min_level = {}
+        for category in CATEGORIES:
+            setattr(self, category, False)
+
+    def enable(self, categories, level=DEBUG, console=False, buffer_size=None):
+        if buffer_size is not None:
+            self.ring = collections.deque(self.ring, maxlen=buffer_size)
+        for category in categories:
+            assert category in CATEGORIES, f"unknown trace category {category}"
+            self._min_level[category] = level
+            setattr(self, category, True)
+        self.console = console
+
+    def disable(self):
+        for category in CATEGORIES:
+            setattr(self, category, False)
+        self._min_level = {}
+        self.console = False
+
+    def open_sink(self, path):
+        self.close()
+        self.sink = open(path, "w")
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+    def emit(self, category, level, message, **fields):
+        enabled = level >= self._min_level.get(category, ERROR + 1)
+        if not enabled and level < WARNING:
+            return
+        record = {"time": time.monotonic(), "tick": self.tick, "cat": category, "level": _LEVEL_NAMES.get(level, level),
+                  "msg": message}
+        record.update(fields)
+        self.ring.append(record)
+        if not enabled:
+            return
+        if self.console:
+            print(message)
+        if self.sink is not None:
+            self.sink.write(json.dumps(record, default=str) + "\n")
+
+    def dump(self, file=None):
+        # The last records, for when something goes wrong
+        file = file or sys.stderr
+        if len(self.ring) == 0:
+            return
+        print(f"Last {len(self.ring)} trace records:", file=file)
+        for record in self.ring:
+            print(f"  [{record['tick']:6}] {record['cat']:5} {record['level']:7} {record['msg'].strip()}", file=file)
+
+TRACE = Tracer()
+
+def add_arguments(parser):
+    parser.add_argument("--trace", metavar="CATEGORIES", help=f"trace these comma separated categories to the console ({', '.join(CATEGORIES)} or all)")
+    parser.add_argument("--trace-level", choices=LEVELS, default="debug", help="lowest level traced (default: %(default)s)")
+    parser.add_argument("--trace-file", metavar="FILE", help="write the trace records to FILE as JSON lines instead of the console")
+    parser.add_argument("--trace-buffer", metavar="N", type=int, default=1000, help="trace records kept in memory and dumped on a crash (default: %(default)s)")
+
+def configure(args):
+    # warnings go to the ring buffer even with tracing off, so its size applies either way
+    TRACE.ring = collections.deque(TRACE.ring, maxlen=args.trace_buffer)
+    if args.trace is None:
+        return
+    categories = CATEGORIES if args.trace == "all" else [c.strip() for c in args.trace.split(",") if c.strip() != ""]
+    TRACE.enable(categories, level=LEVELS[args.trace_level], console=args.trace_file is None)
+    if args.trace_file is not None:
+        TRACE.open_sink(args.trace_file)
@@ -0,0 +1,360 @@
+import argparse
+import io
+import random
+import struct
+import sys
+
+from actions import Action
+from process_file import ObjectType, FrameObject, MovieFrame, AudioFormat, Native32Reader
+from decrypt_header import do_encrypt
+
+__all__ = ["Native32Writer", "encode_image_argb", "encode_image_yuv", "random_image", "stress_game", "check_round_trip"]
+
+# Builds Native32 files from a Python description, so there are test and benchmark inputs that aren't commercial
+# dumps. The add_* methods return the (1-based) index the reader will find the object at.
+
+_INT_PAYLOAD_ACTIONS = (Action.If, Action.GotoFrame, Action.GotoFrame2, Action.Jump)
+
+def encode_image_argb(width, height, pixels):
+    # pixels: width*height ARGB1555 words, those without 0x8000 set are transparent
+    assert len(pixels) == width * height, "wrong number of pixels"
+    body = bytearray()
+    i = 0
+    while i < len(pixels):
+        value = pixels[i]
+        if value & 0x8000 == 0x0:
+            body += b"\0\0"
+            i += 1
+            continue
+        count = 1
+        while i + count < len(pixels) and pixels[i + count] == value and count < 0x3fff:
+            count += 1
+        body += struct.pack("<HH", 0xc000 | count, value)
+        i += count
+    return struct.pack("<HHL", width, height, len(body)) + body
+
+def encode_image_yuv(width, height, quads):
+    # quads: one 6 byte chunk per 2x2 block of pixels, (Y x0y0, Y x0y1, Y x1y0, Y x1y1, V, U). Y=0 is transparent.
+    assert len(quads) == (width // 2) * (height // 2), "wrong number of quads"
+    body = bytearray()
+    i = 0
+    while i < len(quads):
+        count = 1
+        while i + count < len(quads) and quads[i + count] == quads[i] and count < 0x7fff:
+            count += 1
+        if count > 1:
+            body += struct.pack("<H", count) + quads[i]
+            i += count
+            continue
+        # literal quads, up to the start of the next repeat
+        start = i
+        i += 1
+        while i < len(quads) and i - start < 0x7fff and not (i + 1 < len(quads) and quads[i + 1] == quads[i]):
+            i += 1
+        body += struct.pack("<H", 0x8000 | (i - start)) + b"".join(quads[start:i])
+    return struct.pack("<HHL", width, height, len(body)) + body
+
+class Native32Writer:
+    def __init__(self, colorspace="ARGB", resolution=(320, 240), key=b"aber3801"):
+        assert colorspace in ("ARGB", "_YUV"), f"unknown colorspace {colorspace}"
+        self.colorspace = colorspace
+        self.resolution = resolution
+        self.key = key
+        self.frames = [] # lists of FrameObject
+        self.images = [] # encoded images, see encode_image_argb/encode_image_yuv
+        self.actions = [] # (Action, payload), payload is None, an int for If/Jump/GotoFrame(2) or a str
+        self.movies = [] # lists of MovieFrame
+        self.buttons = [] # lists of (keycode, action index)
+        self.sounds = [] # (AudioFormat, data as stored in the file - for YUV games raw samples are big endian)
+
+    def add_frame(self, objects):
+        self.frames.append(list(objects))
+        return len(self.frames)
+
+    def add_image(self, data):
+        self.images.append(bytes(data))
+        return len(self.images)
+
+    def add_script(self, actions):
+        # ends the script with End if it doesn't already
+        start = len(self.actions) + 1
+        for act, payload in actions:
+            if act in _INT_PAYLOAD_ACTIONS:
+                assert isinstance(payload, int), f"{act.name} needs an int payload"
+            self.actions.append((act, payload))
+        if len(self.actions) < start or self.actions[-1][0] != Action.End:
+            self.actions.append((Action.End, None))
+        return start
+
+    def add_movie(self, frames):
+        self.movies.append(list(frames))
+        return len(self.movies)
+
+    def add_button(self, events):
+        self.buttons.append(list(events))
+        return len(self.buttons)
+
+    def add_sound(self, form, data):
+        self.sounds.append((form, bytes(data)))
+        return len(self.sounds)
+
+    def _script_length(self, index):
+        # actions from index up to and including its End, what button events count
+        i = index - 1
+        while i < len(self.actions) and self.actions[i][0] != Action.End:
+            i += 1
+        return min(i + 1, len(self.actions)) - (index - 1)
+
+    def build(self):
+        # Everything after the 0x60 byte prefix is laid out relative to the base, header first:
+        #   0x00 flags, 0x08 load address/binary size/MP3 offset/MP3 length, 0x18 encrypted table offsets,
+        #   0x38 cursor size (no cursor), 0x3C sound table
+        sound_table = 0x3C
+        blob = bytearray(sound_table + 4 * len(self.sounds))
+        strings = {}
+
+        def add(data):
+            offset = len(blob)
+            blob.extend(data)
+            return offset
+
+        def align():
+            blob.extend(b"\0" * (-len(blob) % 4))
+
+        def string(s):
+            if s not in strings:
+                strings[s] = add(s.encode("latin-1") + b"\0")
+            return strings[s]
+
+        for i, (form, data) in enumerate(self.sounds):
+            if form == AudioFormat.RAW:
+                align()
+                offset = add(struct.pack("<L", len(data)) + data)
+                assert offset < 0x10000000, "sound data too far from the base"
+                struct.pack_into("<L", blob, sound_table + 4 * i, offset)
+
+        image_offsets = []
+        for data in self.images:
+            align()
+            image_offsets.append(add(data))
+
+        action_rows = []
+        for act, payload in self.actions:
+            if payload is None or act == Action.End:
+                ptr = 0x0
+            elif act in _INT_PAYLOAD_ACTIONS:
+                align()
+                ptr = add(struct.pack("<h", payload))
+            else:
+                ptr = string(payload)
+            action_rows.append(struct.pack("<LL", act, ptr))
+        align()
+        action_idx = add(b"".join(action_rows) + struct.pack("<LL", 0xFFFFFFFF, 0))
+
+        frame_offsets = []
+        for objects in self.frames:
+            rows = [struct.pack("<HHhhHHL", obj.obj_type, obj.index, obj.x, obj.y, obj.depth, 0,
+                                string(obj.name) if obj.name is not None else 0x0) for obj in objects]
+            align()
+            frame_offsets.append(add(b"".join(rows) + b"\0" * 0x10))
+
+        movie_offsets = []
+        for frames in self.movies:
+            rows = [struct.pack("<HhhHHh", fr.image, fr.x, fr.y, fr.action, fr.sound, fr.u3) for fr in frames]
+            align()
+            movie_offsets.append(add(b"".join(rows) + struct.pack("<HhhHHh", 0xFFFF, 0, 0, 0, 0, 0)))
+
+        button_offsets = []
+        cond_offsets = []
+        for events in self.buttons:
+            align()
+            # the four button images are never drawn
+            button_offsets.append(add(b"\0" * 0x20))
+            rows = [(keycode, self._script_length(event), event) for keycode, event in events]
+            cond_offsets.append(add(struct.pack("<H", sum(r[1] for r in rows)) +
+                                    b"".join(struct.pack("<HHH", *r) for r in rows)))
+
+        align()
+        frame_idx = add(b"".join(struct.pack("<L", o) for o in frame_offsets) + struct.pack("<L", 0x0))
+        image_idx = add(b"".join(struct.pack("<L", o) for o in image_offsets) + struct.pack("<L", 0xFFFFFFFF))
+        movie_idx = add(b"".join(struct.pack("<L", o) for o in movie_offsets) + struct.pack("<L", 0x0))
+        button_idx = add(b"".join(struct.pack("<L", o) for o in button_offsets) + struct.pack("<L", 0x0))
+        button_cond_idx = add(b"".join(struct.pack("<L", o) for o in cond_offsets) + struct.pack("<L", 0x0))
+
+        align()
+        mp3_offset = len(blob)
+        for i, (form, data) in enumerate(self.sounds):
+            if form == AudioFormat.MP3:
+                offset = add(struct.pack("<LH", len(data), 0) + data) - mp3_offset
+                assert offset < 0x10000000, "MP3 data too large"
+                struct.pack_into("<L", blob, sound_table + 4 * i, 0xF0000000 | offset)
+
+        # the readers stop short of the last record, leave them some room
+        blob.extend(b"\0" * 0x40)
+
+        struct.pack_into("<HHHHLLLL", blob, 0x00, 0, 0, 0, 0, 0, len(blob), mp3_offset, 0)
+        tables = struct.pack("<L4sLLLLLL", 0, b"8202", frame_idx, image_idx, action_idx, movie_idx, button_idx, button_cond_idx)
+        blob[0x18:0x38] = do_encrypt(tables, self.key)
+        struct.pack_into("<HH", blob, 0x38, 0, 0)
+
+        generator = f"Resolution_{self.resolution[0]}_{self.resolution[1]}".encode("utf-8")
+        prefix = (self.colorspace.encode("utf-8") + generator.ljust(0x30, b"\0")).ljust(0x60, b"\0")
+        return bytes(prefix + blob)
+
+    def write(self, path):
+        with open(path, "wb") as f:
+            f.write(self.build())
+
+def check_round_trip(writer, data=None):
+    # Read a built file back and compare every table with the description, returns a list of mismatches
+    data = writer.build() if data is None else data
+    r = Native32Reader(io.BytesIO(data))
+    r.init()
+    errors = []
+
+    def expect(what, got, wanted):
+        if got != wanted:
+            errors.append(f"{what}: read {got!r}, wrote {wanted!r}")
+
+    expect("colorspace", r.colorspace, writer.colorspace)
+    expect("resolution", r.resolution, writer.resolution)
+    for indexed in (False, True):
+        if indexed:
+            r.build_index()
+        for i, objects in enumerate(writer.frames, 1):
+            expect(f"frame {i}", list(r.get_frame(i)), objects)
+        expect("frame count", r.get_frame(len(writer.frames) + 1), None)
+        for i, frames in enumerate(writer.movies, 1):
+            expect(f"movie {i}", list(r.get_movie(i)), frames)
+        for i, events in enumerate(writer.buttons, 1):
+            expect(f"button {i}", r.get_button_events(i), events)
+    expect("image count", r.image_count(), len(writer.images))
+    for i, image in enumerate(writer.images, 1):
+        expect(f"image {i}", bytes(r._image_data(i)), image)
+    for i, action in enumerate(writer.actions, 1):
+        expect(f"action {i}", r.get_action(i), action)
+    for i, (form, sound) in enumerate(writer.sounds, 1):
+        if form == AudioFormat.RAW and writer.colorspace == "_YUV":
+            sound = r._endian_swap_resample(sound)
+        form_read, sound_read = r.get_sound(i)
+        expect(f"sound {i}", (form_read, bytes(sound_read)), (form, bytes(sound)))
+    return errors
+
+def random_image(colorspace, width, height, rnd, transparent=0.2):
+    # runs of one colour with transparent gaps, like the sprites in games
+    if colorspace == "ARGB":
+        pixels = []
+        while len(pixels) < width * height:
+            count = min(rnd.randint(1, 40), width * height - len(pixels))
+            value = 0x0 if rnd.random() < transparent else 0x8000 | rnd.randrange(0x8000)
+            pixels.extend([value] * count)
+        return encode_image_argb(width, height, pixels)
+    else:
+        quads = []
+        total = (width // 2) * (height // 2)
+        while len(quads) < total:
+            count = min(rnd.randint(1, 20), total - len(quads))
+            if rnd.random() < transparent:
+                quads.extend([bytes(6)] * count)
+            elif rnd.random() < 0.5:
+                quads.extend([bytes(rnd.randrange(1, 256) for i in range(6))] * count)
+            else:
+                quads.extend(bytes(rnd.randrange(1, 256) for i in range(6)) for i in range(count))
+        return encode_image_yuv(width, height, quads)
+
+def stress_game(colorspace="ARGB", frames=1000, images=500, movies=32, clones=64, script_length=200, sounds=4, seed=1):
+    # A title that loops over `frames` frames, each with a background, a few images, `movies` named movies and
+    # a `script_length` action script; frame 1 clones the first movie `clones` times, and left/right/z move it
+    rnd = random.Random(seed)
+    w = Native32Writer(colorspace)
+    width, height = w.resolution
+
+    background = w.add_image(random_image(colorspace, width, height, rnd, transparent=0.0))
+    sprites = [w.add_image(random_image(colorspace, rnd.randrange(8, 65, 2), rnd.randrange(8, 65, 2), rnd))
+               for i in range(images)]
+
+    # 0.1s of noise each
+    sound_ids = [w.add_sound(AudioFormat.RAW, rnd.randbytes(2 * 2205)) for i in range(sounds)]
+
+    movie_ids = []
+    for i in range(movies):
+        sound = sound_ids[i] if i < len(sound_ids) else 0
+        movie_frames = [MovieFrame(rnd.choice(sprites), rnd.randrange(-8, 9), rnd.randrange(-8, 9), 0,
+                                   sound if j == 0 else 0, 0) for j in range(rnd.randint(2, 6))]
+        movie_ids.append(w.add_movie(movie_frames))
+
+    # straight-line arithmetic and string work on a handful of variables
+    body = []
+    while len(body) < script_length:
+        var = f"v{rnd.randrange(8)}"
+        if rnd.random() < 0.7:
+            body += [(Action.Push, var), (Action.Push, var), (Action.GetVariable, None), (Action.Push, str(rnd.randrange(100))),
+                     (Action.Add, None), (Action.SetVariable, None)]
+        else:
+            body += [(Action.Push, var), (Action.Push, "s"), (Action.Push, var), (Action.GetVariable, None),
+                     (Action.StringAdd, None), (Action.StringLength, None), (Action.SetVariable, None)]
+    script = w.add_script(body[:script_length])
+
+    cloning = []
+    for i in range(clones):
+        name = f"clone{i}"
+        cloning += [(Action.Push, "m1"), (Action.Push, name), (Action.Push, str(1000 + i)), (Action.CloneSprite, None),
+                    (Action.Push, name), (Action.Push, "0"), (Action.Push, str(rnd.randrange(width))), (Action.SetProperty, None),
+                    (Action.Push, name), (Action.Push, "1"), (Action.Push, str(rnd.randrange(height))), (Action.SetProperty, None)]
+    clone_script = w.add_script(cloning)
+    # GotoFrame goes to one frame past its payload
+    loop_script = w.add_script([(Action.GotoFrame, 0)])
+
+    def move(dx):
+        return w.add_script([(Action.Push, "m1"), (Action.Push, "0"), (Action.Push, "m1"), (Action.Push, "0"),
+                             (Action.GetProperty, None), (Action.Push, str(dx)), (Action.Add, None), (Action.SetProperty, None)])
+    button = w.add_button([(0x0200, move(-4)), (0x0400, move(4)), (0x4000, move(0))])
+
+    positions = [(rnd.randrange(width), rnd.randrange(height)) for i in range(movies)]
+    for i in range(frames):
+        objects = [FrameObject(ObjectType.Image, background, 0, 0, 0, None)]
+        for j in range(4):
+            objects.append(FrameObject(ObjectType.Image, rnd.choice(sprites), rnd.randrange(width), rnd.randrange(height), 1 + j, None))
+        for j, movie in enumerate(movie_ids):
+            x, y = positions[j]
+            objects.append(FrameObject(ObjectType.Movie, movie, x, y, 10 + j, f"m{j + 1}"))
+        objects.append(FrameObject(ObjectType.Button, button, 0, 0, 0, None))
+        if i == 0:
+            objects.append(FrameObject(ObjectType.Action, clone_script, 0, 0, 0, None))
+        objects.append(FrameObject(ObjectType.Action, script, 0, 0, 0, None))
+        if i == frames - 1:
+            objects.append(FrameObject(ObjectType.Action, loop_script, 0, 0, 0, None))
+        w.add_frame(objects)
+    return w
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Native32 stress-test game")
+    parser.add_argument("out", help="game file to write")
+    parser.add_argument("--colorspace", choices=("ARGB", "YUV"), default="ARGB", help="image format (default: %(default)s)")
+    parser.add_argument("--frames", metavar="N", type=int, default=1000, help="frames (default: %(default)s)")
+    parser.add_argument("--images", metavar="N", type=int, default=500, help="sprite images (default: %(default)s)")
+    parser.add_argument("--movies", metavar="N", type=int, default=32, help="movies on screen in every frame (default: %(default)s)")
+    parser.add_argument("--clones", metavar="N", type=int, default=64, help="clones of the first movie (default: %(default)s)")
+    parser.add_argument("--script-length", metavar="N", type=int, default=200, help="actions in the per-frame script (default: %(default)s)")
+    parser.add_argument("--sounds", metavar="N", type=int, default=4, help="raw sounds, played by the first movies (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: %(default)s)")
+    parser.add_argument("--check", action="store_true", help="read the game back and check it matches what was written")
+    args = parser.parse_args()
+    colorspace = "_YUV" if args.colorspace == "YUV" else "ARGB"
+    w = stress_game(colorspace, frames=args.frames, images=args.images, movies=args.movies, clones=args.clones,
+                    script_length=args.script_length, sounds=args.sounds, seed=args.seed)
+    data = w.build()
+    with open(args.out, "wb") as f:
+        f.write(data)
+    print(f"Wrote {args.out}: {len(w.frames)} frames, {len(w.images)} images, {len(w.movies)} movies, "
+          f"{len(w.actions)} actions, {len(data) // 1024}KiB")
+    if args.check:
+        errors = check_round_trip(w, data)
+        for error in errors:
+            print(error)
+        print(f"{len(errors)} mismatches")
+        if errors:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()